@@ -1,18 +1,17 @@
-import asyncio
+from contextlib import asynccontextmanager
 from typing import Optional, List, AsyncGenerator
 from pydantic import BaseModel
-from huggingface_hub import InferenceClient
 import json
 
-from fastapi import FastAPI, WebSocket
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, WebSocket, Request
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import os
 from utils.tools import tools
 
 
 # Import model configuration
-from model_config import AVAILABLE_MODELS, MODEL_ROUTING
+from model_config import AVAILABLE_MODELS, MODEL_ROUTING, get_model_endpoints
 
 # Fix the import - make sure this function exists and is properly imported
 try:
@@ -25,9 +24,40 @@ except ImportError as e:
 
 from sandbox_agent import process_chat_with_tools_streaming
 from delete_sandbox import delete_sandbox
-from utils.websocket_utils import add_log_connection, remove_log_connection, log_connections, process_queued_logs, get_queue_size
+from utils.websocket_utils import SlowConsumerError, start_log_hub, subscribe_logs, unsubscribe_logs, get_last_log_seq, get_queue_size, get_log_buffer_size, get_log_subscriber_stats
+from utils.sandbox_registry import get_sandbox_cache_stats
+from utils.tool_executor import get_tool_executor_stats
+from utils.process_registry import get_process_registry_stats
+from utils.file_cache import get_file_cache_stats
+from utils.patching import get_patch_stats
+from utils.context_compaction import get_compaction_stats
+from utils.output_store import get_output_store_stats
+from utils.session_store import get_session_store_stats
+from utils.prompt_prefix import get_prompt_prefix_stats
+from utils.model_scheduler import get_model_scheduler_stats
+from utils.project_tree import get_project_tree, get_project_tree_stats, PROJECT_TREE_MAX_PAGE_SIZE
+from utils.sandbox_pool import sandbox_pool
+from utils.template_cache import get_template_cache_stats
+from start_app import TEMPLATE_VERSION
+from utils.inference_pool import BalancedInferenceClient, close_inference_clients, get_inference_pool_stats
+from utils.endpoint_balancer import start_endpoint_health_checks, stop_endpoint_health_checks, get_endpoint_health, get_endpoint_balancer_stats
+from utils.request_hedging import get_hedging_stats
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Let tool worker threads publish logs onto this event loop
+    start_log_hub()
+    # Keep warm sandboxes ready for new sessions (disabled unless SANDBOX_POOL_SIZE > 0)
+    sandbox_pool.start()
+    # Eject and re-admit model replicas based on periodic health checks
+    start_endpoint_health_checks()
+    yield
+    sandbox_pool.stop()
+    await stop_endpoint_health_checks()
+    # Close pooled inference clients on shutdown
+    await close_inference_clients()
+
+app = FastAPI(lifespan=lifespan)
 HF_TOKEN = os.getenv("HF_TOKEN")
 print(f"Using HF_TOKEN: {HF_TOKEN}")
 
@@ -47,6 +77,9 @@ class ChatRequest(BaseModel):
     model: str = "Qwen/Qwen2.5-7B-Instruct"
     messages: List[Message]
     serviceId: Optional[str] = None
+    # With a sessionId the server keeps the conversation between turns and messages
+    # only needs the new ones; the "session" event tells whether history was resumed
+    sessionId: Optional[str] = None
 
 class DeleteRequest(BaseModel):
     serviceId: str
@@ -55,32 +88,17 @@ class DeleteRequest(BaseModel):
 def read_root():
     return {"Hello": "World"}
 
-# Helper function to create InferenceClient based on model routing
-def create_inference_client(model: str) -> tuple[InferenceClient, Optional[str]]:
-    """
-    Create an InferenceClient for the given model.
-    Returns (client, endpoint_url) where endpoint_url is None for local models.
-    """
-    if model in MODEL_ROUTING:
-        # External endpoint
-        endpoint_config = MODEL_ROUTING[model]
-        client = InferenceClient(model=endpoint_config["endpoint"], token=HF_TOKEN)
-        return client, endpoint_config["endpoint"]
-    else:
-        # Local HF model
-        client = InferenceClient(model, token=HF_TOKEN)
-        return client, None
-
 @app.post("/chat")
 async def generate_chat(request: ChatRequest):
     """Streaming chat endpoint"""
     
     async def event_generator() -> AsyncGenerator[str, None]:
-        # Create client based on model routing
-        client, endpoint_url = create_inference_client(request.model)
+        # Each model call picks the least loaded healthy replica and leases its pooled client
+        client = BalancedInferenceClient(request.model)
+        endpoint_urls = get_model_endpoints(request.model)
         
-        if endpoint_url:
-            print(f"Using external endpoint for {request.model}: {endpoint_url}")
+        if endpoint_urls:
+            print(f"Using external endpoints for {request.model}: {', '.join(endpoint_urls)}")
         else:
             print(f"Using local HF Inference API for {request.model}")
         
@@ -96,7 +114,8 @@ async def generate_chat(request: ChatRequest):
                 service_id=request.serviceId,
                 max_iterations=10,
                 log_service_id=request.serviceId,
-                model=request.model
+                model=request.model,
+                session_id=request.sessionId
             ):
                 # Send as Server-Sent Events (SSE) format
                 yield f"data: {json.dumps(chunk)}\n\n"
@@ -107,7 +126,7 @@ async def generate_chat(request: ChatRequest):
                 "type": "error",
                 "error": str(e),
                 "model": request.model,
-                "message": f"Error connecting to {request.model}" + (f" endpoint ({endpoint_url})" if endpoint_url else "")
+                "message": f"Error connecting to {request.model}" + (f" endpoints ({', '.join(endpoint_urls)})" if endpoint_urls else "")
             }
             yield f"data: {json.dumps(error_chunk)}\n\n"
         
@@ -129,13 +148,46 @@ async def generate_chat(request: ChatRequest):
     )
 
 @app.get("/file-structure")
-def get_file_structure(serviceId: str):
-    from run_command import run_command
+def get_file_structure(
+    serviceId: str,
+    request: Request,
+    root: Optional[str] = None,
+    depth: Optional[int] = None,
+    ignore: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 500
+):
+    """
+    Structured, paginated tree of a sandbox directory (the project by default).
+    ignore is a comma separated list of names to skip, replacing the defaults.
+    Send the returned ETag back as If-None-Match to get a 304 while nothing changed.
+    """
+    ignore_patterns = None if ignore is None else [pattern.strip() for pattern in ignore.split(",") if pattern.strip()]
+    limit = min(max(limit, 1), PROJECT_TREE_MAX_PAGE_SIZE)
+    try:
+        result = get_project_tree(serviceId, root, depth, ignore_patterns, offset, limit)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except Exception as e:
+        # Sandbox lookups and exec failures, e.g. a sandbox that is gone or still starting
+        print(f"[ProjectTree] Could not list {root or 'project'} in {serviceId}: {e}")
+        return JSONResponse(status_code=502, content={"error": f"Could not list the sandbox files: {e}"})
+    
+    etag = f'"{result["etag"]}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
     
-    # Exclude node cache and show actual project files
-    command = "find /tmp -type f -o -type d | grep -v node-compile-cache | head -50"
-    output = run_command(serviceId, command)
-    return {"file_structure": output}
+    # Flat path list kept for clients that read the old text format
+    result["file_structure"] = "\n".join(_tree_paths(result["tree"]))
+    return JSONResponse(content=result, headers=headers)
+
+def _tree_paths(node: dict) -> List[str]:
+    paths = []
+    for child in node.get("children", []):
+        paths.append(child["path"])
+        paths.extend(_tree_paths(child))
+    return paths
 
 @app.post("/delete-sandbox")
 def delete_sandbox_request(request: DeleteRequest):
@@ -144,52 +196,60 @@ def delete_sandbox_request(request: DeleteRequest):
 
 # Websocket endpoint that updates the client when any logs are generated on the server side
 @app.websocket("/ws/logs/{serviceId}")
-async def websocket_logs_endpoint(websocket: WebSocket, serviceId: str):
+async def websocket_logs_endpoint(websocket: WebSocket, serviceId: str, since: Optional[int] = None):
     print(f"New WebSocket log connection for serviceId: {serviceId}")
-    """Dedicated endpoint for streaming tool execution logs"""
+    """
+    Dedicated endpoint for streaming tool execution logs.
+    Pass ?since=<seq> to replay buffered logs newer than seq before the live tail.
+    """
     
     await websocket.accept()
     
-    # Add this connection using the utility function
-    add_log_connection(serviceId, websocket)
-    
-    # Local heartbeat counter for this connection
-    heartbeat_counter = 0
+    # Subscribe this connection to the log hub, collecting any missed logs
+    subscriber, replay = subscribe_logs(serviceId, websocket, since)
     
     try:
         await websocket.send_json({
             "type": "connection_status",
-            "message": f"📡 Connected to sandbox {serviceId} logs"
+            "message": f"📡 Connected to sandbox {serviceId} logs",
+            "data": {"last_seq": get_last_log_seq(serviceId), "replayed": len(replay)}
         })
         
-        # Keep connection alive and process queued logs
+        # Replay missed logs before the live tail
+        for seq, payload in replay:
+            await subscriber.send(seq, payload)
+        
+        # Wait for published logs, sending a heartbeat after 30 idle seconds
         while True:
-            # Process any queued logs from sync contexts
-            await process_queued_logs()
+            event = await subscriber.get(timeout=30)
             
-            await asyncio.sleep(1)  # Check for logs every second
-            
-            # Increment heartbeat counter
-            heartbeat_counter += 1
-                
-            # Send heartbeat every 30 iterations (30 seconds)
-            if heartbeat_counter >= 30:
+            if event is None:
                 try:
                     await websocket.send_json({
                         "type": "heartbeat", 
                         "message": "💓 Connection alive"
                     })
-                    heartbeat_counter = 0  # Reset counter
                 except Exception as e:
                     print(f"Heartbeat failed for {serviceId}: {e}")
                     break  # Exit loop if heartbeat fails
+                continue
             
+            # Each connection sends from its own task, so a slow client
+            # never delays delivery to the other viewers of this sandbox
+            await subscriber.send(*event)
+            
+    except SlowConsumerError as e:
+        print(f"[WebSocket] Disconnecting slow log client for {serviceId}: {e}")
+        try:
+            await websocket.close(code=1013, reason="Log consumer too slow")
+        except Exception:
+            pass
     except Exception as e:
         print(f"WebSocket log connection error for {serviceId}: {e}")
         # Don't try to send error message - connection is likely dead
     finally:
         # Remove connection first
-        remove_log_connection(serviceId, websocket)
+        unsubscribe_logs(subscriber)
         
         # Only try to close if not already closed
         try:
@@ -220,15 +280,98 @@ def get_service_url(serviceId: str):
 
 @app.get("/debug/queue-status")
 def get_queue_status():
-    """Debug endpoint to check log queue status"""
+    """Debug endpoint to check buffered logs and subscribers"""
+    subscriber_stats = get_log_subscriber_stats()
     return {
         "queue_size": get_queue_size(),
+        "replay_buffer_size": get_log_buffer_size(),
         "active_connections": {
-            service_id: len(connections) 
-            for service_id, connections in log_connections.items()
-        }
+            service_id: stats["connections"]
+            for service_id, stats in subscriber_stats.items()
+        },
+        "subscribers": subscriber_stats
     }
 
+@app.get("/debug/sandbox-cache")
+def get_sandbox_cache_status():
+    """Debug endpoint to check the sandbox handle cache"""
+    return get_sandbox_cache_stats()
+
+@app.get("/debug/model-scheduler")
+def get_model_scheduler_status():
+    """Debug endpoint to check per-model concurrency and queues"""
+    return get_model_scheduler_stats()
+
+@app.get("/debug/prompt-prefix")
+def get_prompt_prefix_status():
+    """Debug endpoint to verify the prompt prefix stays stable (set PROMPT_PREFIX_CHECK=true)"""
+    return get_prompt_prefix_stats()
+
+@app.get("/debug/session-store")
+def get_session_store_status():
+    """Debug endpoint to check stored chat sessions"""
+    return get_session_store_stats()
+
+@app.get("/debug/project-tree")
+def get_project_tree_status():
+    """Debug endpoint to check the cached /file-structure listings"""
+    return get_project_tree_stats()
+
+@app.get("/debug/output-store")
+def get_output_store_status():
+    """Debug endpoint to check spilled tool outputs"""
+    return get_output_store_stats()
+
+@app.get("/debug/context-compaction")
+def get_context_compaction_status():
+    """Debug endpoint to check how much agent context was compacted"""
+    return get_compaction_stats()
+
+@app.get("/debug/patch-stats")
+def get_patch_status():
+    """Debug endpoint to check apply_patch usage and the model output it saved"""
+    return get_patch_stats()
+
+@app.get("/debug/file-cache")
+def get_file_cache_status():
+    """Debug endpoint to check the sandbox file content cache"""
+    return get_file_cache_stats()
+
+@app.get("/debug/process-registry")
+def get_process_registry_status():
+    """Debug endpoint to check the cached sandbox process lists"""
+    return get_process_registry_stats()
+
+@app.get("/debug/tool-executor")
+def get_tool_executor_status():
+    """Debug endpoint to check tool executor queue depth"""
+    return get_tool_executor_stats()
+
+@app.get("/debug/hedging")
+def get_hedging_status():
+    """Debug endpoint to check hedged model requests and time-to-first-chunk percentiles"""
+    return get_hedging_stats()
+
+@app.get("/debug/endpoints")
+def get_endpoints_status():
+    """Debug endpoint to check model replica load, latency and circuit breakers"""
+    return get_endpoint_balancer_stats()
+
+@app.get("/debug/inference-pool")
+def get_inference_pool_status():
+    """Debug endpoint to check pooled inference clients"""
+    return get_inference_pool_stats()
+
+@app.get("/debug/sandbox-pool")
+def get_sandbox_pool_status():
+    """Debug endpoint to check the warm sandbox pool"""
+    return sandbox_pool.stats()
+
+@app.get("/debug/template-cache")
+def get_template_cache_status():
+    """Debug endpoint to check the cached project template"""
+    return get_template_cache_stats(TEMPLATE_VERSION)
+
 @app.get("/models")
 def get_models():
     """Get available models with routing information"""
@@ -239,6 +382,11 @@ def get_models():
             "external": {
                 model: config["endpoint"] 
                 for model, config in MODEL_ROUTING.items()
+            },
+            # Every replica of each external model with its health and circuit state
+            "endpoints": {
+                model: get_endpoint_health(model)
+                for model in MODEL_ROUTING
             }
         }
     }
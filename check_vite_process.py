@@ -1,4 +1,4 @@
-from koyeb import Sandbox
+from utils.process_registry import find_dev_server
 from typing import Tuple, Optional
 
 def check_vite_process(service_id: str, api_token: str) -> Tuple[bool, Optional[any], str]:
@@ -13,14 +13,12 @@ def check_vite_process(service_id: str, api_token: str) -> Tuple[bool, Optional[
         Tuple of (is_running, process_object, status_string)
     """
     try:
-        sandbox = Sandbox.get_from_id(service_id, api_token=api_token)
-        processes = sandbox.list_processes()
-        
-        for process in processes:
-            # Check if it's a Vite/npm dev process
-            if process.status == "running" and ('npm run dev' in process.command or 'vite' in process.command.lower()):
-                print(f"Found existing Vite process: {process.id} - Status: {process.status}")
-                return True, process, process.status
+        # Served from the per-sandbox process registry, which avoids a
+        # list_processes round-trip on every check
+        process = find_dev_server(service_id, api_token=api_token)
+        if process is not None:
+            print(f"Found existing Vite process: {process.id} - Status: {process.status}")
+            return True, process, process.status
         
         return False, None, "not_found"
     except Exception as e:
@@ -1,7 +1,8 @@
 import os
 from koyeb import Sandbox
+from utils.sandbox_registry import register_sandbox
 
-def create_sandbox_client(image: str = "koyeb/sandbox", name: str = "example-sandbox"):
+def create_sandbox_client(image: str = "koyeb/sandbox", name: str = "example-sandbox", instance_type: str = "small"):
     api_token = os.getenv("KOYEB_API_TOKEN")
     print(api_token)
     if not api_token:
@@ -15,7 +16,7 @@ def create_sandbox_client(image: str = "koyeb/sandbox", name: str = "example-san
             name=name,
             wait_ready=True,
             api_token=api_token,
-            instance_type="small"
+            instance_type=instance_type
         )
 
         # Check status
@@ -26,6 +27,7 @@ def create_sandbox_client(image: str = "koyeb/sandbox", name: str = "example-san
         result = sandbox.exec("echo 'Sandbox is ready!'")
         print(result.stdout.strip())
         print(f"Sandbox ID: {sandbox.service_id}")
+        register_sandbox(sandbox)
         return sandbox.service_id
 
     except Exception as e:
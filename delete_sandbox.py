@@ -1,4 +1,9 @@
-from koyeb import Sandbox
+from utils.sandbox_registry import get_sandbox, invalidate_sandbox
+from utils.process_registry import invalidate_processes
+from utils.file_cache import invalidate_files
+from utils.output_store import drop_outputs
+from utils.project_tree import forget_sandbox_trees
+from utils.session_store import drop_sessions_for_service
 import os
 
 def delete_sandbox(service_id: str) -> str:
@@ -6,9 +11,17 @@ def delete_sandbox(service_id: str) -> str:
     if not api_token:
         raise ValueError("KOYEB_API_TOKEN not set") 
 
-    sandbox = Sandbox.get_from_id(service_id, api_token=api_token)
+    sandbox = get_sandbox(service_id, api_token=api_token)
     if not sandbox:
         raise ValueError(f"Sandbox with ID {service_id} not found")
 
-    sandbox.delete()
+    try:
+        sandbox.delete()
+    finally:
+        invalidate_sandbox(service_id)
+        invalidate_processes(service_id)
+        invalidate_files(service_id)
+        drop_outputs(service_id)
+        forget_sandbox_trees(service_id)
+        drop_sessions_for_service(service_id)
     return f"Sandbox with ID {service_id} has been deleted."
\ No newline at end of file
@@ -1,4 +1,4 @@
-from koyeb import Sandbox
+from utils.sandbox_registry import get_sandbox
 import os
 
 from koyeb.sandbox import sandbox
@@ -7,7 +7,7 @@ def expose_endpoint(service_id: str, port: int) -> str:
     api_token = os.getenv("KOYEB_API_TOKEN")
     if not api_token:
         raise ValueError("KOYEB_API_TOKEN not set")
-    sandbox = Sandbox.get_from_id(service_id, api_token=api_token)
+    sandbox = get_sandbox(service_id, api_token=api_token)
     if not sandbox:
         raise ValueError(f"Sandbox with ID {service_id} not found")
 
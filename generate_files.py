@@ -1,6 +1,18 @@
 
-from koyeb import Sandbox
+from utils.sandbox_registry import get_sandbox
+from utils.file_cache import get_cached_file, is_unchanged, record_file, invalidate_file
+from utils.project_tree import invalidate_tree
+from utils.patching import PatchError, apply_unified_diff, apply_search_replace, record_patch, record_patch_failure
+from typing import Dict, List, Optional
+import base64
+import hashlib
+import io
+import json
 import os
+import posixpath
+import tarfile
+import time
+import uuid
 
 def create_file_and_add_code(service_id: str, file_path: str, code: str):
     print(f"Creating file at {file_path} in sandbox {service_id} with code:\n{code}")
@@ -10,8 +22,14 @@ def create_file_and_add_code(service_id: str, file_path: str, code: str):
         return
     print(f"file_path: {file_path}")
     sandbox = None
+    data = code.encode("utf-8")
+    summary = f"{len(data)} bytes, sha256 {hashlib.sha256(data).hexdigest()[:16]}"
+
+    # Skip the remote write when the sandbox already holds this exact content
+    if is_unchanged(service_id, file_path, code):
+        return f"File {file_path} is unchanged ({summary})."
     try:
-        sandbox = Sandbox.get_from_id(service_id, api_token=api_token)
+        sandbox = get_sandbox(service_id, api_token=api_token)
 
         fs = sandbox.filesystem
         # Ensure directory exists
@@ -20,13 +38,13 @@ def create_file_and_add_code(service_id: str, file_path: str, code: str):
             sandbox.exec(f"mkdir -p {dir_path}")
         # Write file
         fs.write_file(file_path, code)
+        record_file(service_id, file_path, code)
+        invalidate_tree(service_id)
 
-        # Read file
-        file_info = fs.read_file(file_path)
-        print(file_info.content)
-
-        return f"File created at {file_path} and code added successfully: {file_info.content}."
+        # Don't echo the content back, the model already has it
+        return f"File created at {file_path} ({summary})."
     except Exception as e:
+        invalidate_file(service_id, file_path)
         print(f"Error: {e}")
 
 def read_file(file_path: str, service_id: str) -> str:
@@ -35,8 +53,13 @@ def read_file(file_path: str, service_id: str) -> str:
         print("Error: KOYEB_API_TOKEN not set")
         return ""
     sandbox = None
+
+    # Served locally when we wrote or read the file since the last shell command
+    cached = get_cached_file(service_id, file_path)
+    if cached is not None:
+        return cached
     try:
-        sandbox = Sandbox.get_from_id(service_id, api_token=api_token)
+        sandbox = get_sandbox(service_id, api_token=api_token)
 
         fs = sandbox.filesystem
         # Ensure directory exists
@@ -48,7 +71,152 @@ def read_file(file_path: str, service_id: str) -> str:
         file_info = fs.read_file(file_path)
         print(file_info.content)
 
+        record_file(service_id, file_path, file_info.content)
         return file_info.content
     except Exception as e:
         print(f"Error: {e}")
-        return f"Error reading file: {e}"
\ No newline at end of file
+        return f"Error reading file: {e}"
+
+def _normalize_files(files: List[Dict[str, str]]) -> List[tuple[str, str]]:
+    """Validate the requested files and return (path, content) pairs"""
+    normalized = []
+    seen = set()
+    for entry in files:
+        path = entry.get("path") or entry.get("file_path")
+        content = entry.get("content")
+        if content is None:
+            content = entry.get("code", "")
+        if not path or not path.startswith("/"):
+            raise ValueError(f"File path must be absolute: {path!r}")
+        path = posixpath.normpath(path)
+        if path in seen:
+            raise ValueError(f"Duplicate file path: {path}")
+        seen.add(path)
+        normalized.append((path, content))
+    return normalized
+
+def _build_archive(files: List[tuple[str, str]]) -> bytes:
+    """Pack (path, content) pairs into a gzipped tarball rooted at /"""
+    buffer = io.BytesIO()
+    now = time.time()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for path, content in files:
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(name=path.lstrip("/"))
+            info.size = len(data)
+            info.mode = 0o644
+            info.mtime = now
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+def write_files(service_id: str, files: List[Dict[str, str]]):
+    """
+    Create or overwrite several files with one upload and one extract.
+    Parent directories are created as needed. Returns paths, sizes and content hashes.
+    """
+    api_token = os.getenv("KOYEB_API_TOKEN")
+    if not api_token:
+        print("Error: KOYEB_API_TOKEN not set")
+        return "Error writing files: KOYEB_API_TOKEN not set"
+    if not files:
+        return "Error writing files: no files given"
+    changed = []
+    try:
+        normalized = _normalize_files(files)
+        written = []
+        for path, content in normalized:
+            data = content.encode("utf-8")
+            unchanged = is_unchanged(service_id, path, content)
+            if not unchanged:
+                changed.append((path, content))
+            written.append({
+                "path": path,
+                "bytes": len(data),
+                "sha256": hashlib.sha256(data).hexdigest()[:16],
+                "unchanged": unchanged,
+            })
+
+        if changed:
+            print(f"Writing {len(changed)} files in sandbox {service_id}: {[path for path, _ in changed]}")
+            sandbox = get_sandbox(service_id, api_token=api_token)
+
+            # The file API transfers text, so ship the archive base64 encoded and decode it remotely
+            archive = _build_archive(changed)
+            remote_path = f"/tmp/.write-files-{uuid.uuid4().hex}.tgz.b64"
+            sandbox.filesystem.write_file(remote_path, base64.b64encode(archive).decode("ascii"))
+            result = sandbox.exec(
+                f"base64 -d {remote_path} | tar -xzf - -C / --no-same-owner; status=$?; rm -f {remote_path}; exit $status"
+            )
+            invalidate_tree(service_id)
+            if getattr(result, "exit_code", 0) != 0:
+                # The extract may have written some of the files
+                for path, _ in changed:
+                    invalidate_file(service_id, path)
+                return f"Error writing files: {result.stderr}"
+
+            for path, content in changed:
+                record_file(service_id, path, content)
+
+        return {
+            "files": written,
+            "total_bytes": sum(entry["bytes"] for entry in written),
+        }
+    except Exception as e:
+        for path, _ in changed:
+            invalidate_file(service_id, path)
+        print(f"Error: {e}")
+        return f"Error writing files: {e}"
+
+def apply_patch(service_id: str, file_path: str, diff: Optional[str] = None, edits: Optional[List[Dict[str, str]]] = None):
+    """
+    Edit a file with a unified diff or search/replace edits instead of resending it whole.
+    Nothing is written unless every hunk or edit applies; failures are reported per hunk.
+    """
+    api_token = os.getenv("KOYEB_API_TOKEN")
+    if not api_token:
+        print("Error: KOYEB_API_TOKEN not set")
+        return "Error applying patch: KOYEB_API_TOKEN not set"
+    if not diff and not edits:
+        return "Error applying patch: provide either diff or edits"
+    print(f"Patching {file_path} in sandbox {service_id}")
+    try:
+        # Patch against the cached copy when we have one
+        original = get_cached_file(service_id, file_path)
+        if original is None:
+            sandbox = get_sandbox(service_id, api_token=api_token)
+            if not sandbox.filesystem.exists(file_path):
+                return f"Error applying patch: file {file_path} does not exist. Use create_file_and_add_code to create it."
+            original = sandbox.filesystem.read_file(file_path).content
+            record_file(service_id, file_path, original)
+
+        try:
+            if diff:
+                content, applied = apply_unified_diff(original, diff)
+                patch_bytes = len(diff.encode("utf-8"))
+            else:
+                content, applied = apply_search_replace(original, edits)
+                patch_bytes = len(json.dumps(edits).encode("utf-8"))
+        except PatchError as e:
+            record_patch_failure()
+            return f"Error applying patch to {file_path}, nothing was written:\n{e}"
+
+        data = content.encode("utf-8")
+        summary = f"{len(data)} bytes, sha256 {hashlib.sha256(data).hexdigest()[:16]}"
+        if content == original:
+            return f"Patch applied to {file_path} without changes ({summary})."
+
+        sandbox = get_sandbox(service_id, api_token=api_token)
+        try:
+            sandbox.filesystem.write_file(file_path, content)
+        except Exception:
+            invalidate_file(service_id, file_path)
+            raise
+        record_file(service_id, file_path, content)
+        invalidate_tree(service_id)
+        record_patch(patch_bytes, len(data))
+
+        unit = "hunks" if diff else "edits"
+        return f"Patched {file_path}: {applied} {unit} applied ({summary})."
+    except Exception as e:
+        print(f"Error: {e}")
+        return f"Error applying patch: {e}"
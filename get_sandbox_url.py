@@ -1,4 +1,4 @@
-from koyeb import Sandbox
+from utils.sandbox_registry import get_sandbox
 import os
 
 def get_sandbox_url(service_id: str) -> str:
@@ -6,7 +6,7 @@ def get_sandbox_url(service_id: str) -> str:
     if not api_token:
         raise ValueError("KOYEB_API_TOKEN not set") 
 
-    sandbox = Sandbox.get_from_id(service_id, api_token=api_token)
+    sandbox = get_sandbox(service_id, api_token=api_token)
     if not sandbox:
         raise ValueError(f"Sandbox with ID {service_id} not found")
 
@@ -3,43 +3,121 @@ Model Configuration
 Configure available models and their routing (local vs external endpoints)
 """
 import os
+from typing import Callable, List, Union
 
 # Available models that users can select
 AVAILABLE_MODELS = {
     "Qwen/Qwen3-Coder-30B-A3B-Instruct": "Qwen 3 Coder 30B A3B Instruct",
 }
 
+def _endpoints_from_env(name: str) -> List[str]:
+    """Comma separated replica URLs from <name>s, falling back to the single-endpoint <name>"""
+    value = os.getenv(f"{name}s") or os.getenv(name) or ""
+    return [endpoint.strip() for endpoint in value.split(",") if endpoint.strip()]
+
+_qwen3_coder_endpoints = _endpoints_from_env("Qwen3_Coder_30B_A3B_Instruct_Endpoint")
+
 # Model routing configuration
 # Models listed here will use external vLLM endpoints
 # Models not listed will use Hugging Face Inference API
+# "endpoints" lists every replica of a model, requests are balanced across them;
+# "endpoint" is the first replica, kept for callers that expect a single URL
 MODEL_ROUTING = {
     "Qwen/Qwen3-Coder-30B-A3B-Instruct": {
-        "endpoint": os.getenv("Qwen3_Coder_30B_A3B_Instruct_Endpoint"),
+        "endpoint": _qwen3_coder_endpoints[0] if _qwen3_coder_endpoints else None,
+        "endpoints": _qwen3_coder_endpoints,
         "model_name": "Qwen/Qwen3-Coder-30B-A3B-Instruct",
     }
 }
 
+def get_model_endpoints(model_id: str) -> List[str]:
+    """All replica URLs of an external model, empty for Hugging Face Inference API models"""
+    routing = MODEL_ROUTING.get(model_id)
+    if not routing:
+        return []
+    endpoints = routing.get("endpoints") or ([routing["endpoint"]] if routing.get("endpoint") else [])
+    return list(endpoints)
+
+# Prompt token budget per model: older tool results are compacted to stay under it
+# Models not listed use DEFAULT_CONTEXT_BUDGET, 0 disables compaction
+DEFAULT_CONTEXT_BUDGET = int(os.getenv("DEFAULT_CONTEXT_BUDGET", "16000"))
+
+MODEL_CONTEXT_BUDGETS = {
+    "Qwen/Qwen3-Coder-30B-A3B-Instruct": int(os.getenv("Qwen3_Coder_30B_A3B_Instruct_Context_Budget", "24000")),
+}
+
+def get_context_budget(model_id: str) -> int:
+    """Prompt token budget for a model"""
+    return MODEL_CONTEXT_BUDGETS.get(model_id, DEFAULT_CONTEXT_BUDGET)
+
+# Concurrent chat_completion calls allowed per model endpoint, further calls wait in a queue
+DEFAULT_MODEL_CONCURRENCY = int(os.getenv("DEFAULT_MODEL_CONCURRENCY", "8"))
+
+MODEL_CONCURRENCY_LIMITS = {
+    "Qwen/Qwen3-Coder-30B-A3B-Instruct": int(os.getenv("Qwen3_Coder_30B_A3B_Instruct_Concurrency", "8")),
+}
+
+def get_model_concurrency(model_id: str) -> int:
+    """Concurrent request limit for a model"""
+    return MODEL_CONCURRENCY_LIMITS.get(model_id, DEFAULT_MODEL_CONCURRENCY)
+
+# Models whose slow chat_completion calls are duplicated to a second endpoint (opt-in)
+MODEL_HEDGING = {
+    "Qwen/Qwen3-Coder-30B-A3B-Instruct": os.getenv("Qwen3_Coder_30B_A3B_Instruct_Hedging", "false").lower() == "true",
+}
+
+def is_hedging_enabled(model_id: str) -> bool:
+    """Whether hedged requests are enabled for a model"""
+    return MODEL_HEDGING.get(model_id, False)
+
+# Callbacks notified with the model_id whenever a model's routing changes
+_config_listeners: List[Callable[[str], None]] = []
+
+def register_config_listener(callback: Callable[[str], None]):
+    """Register a callback to be called with the model_id when its configuration changes"""
+    _config_listeners.append(callback)
+
+def _notify_config_change(model_id: str):
+    for callback in _config_listeners:
+        try:
+            callback(model_id)
+        except Exception as e:
+            print(f"[model_config] Config listener failed for {model_id}: {e}")
+
 # Helper function to add a new model
-def add_model(model_id: str, display_name: str, endpoint: str = None):
+def add_model(model_id: str, display_name: str, endpoint: Union[str, List[str]] = None, context_budget: int = None, concurrency: int = None, hedging: bool = None):
     """
     Add a new model to the configuration
     
     Args:
         model_id: The HuggingFace model ID (e.g., "Qwen/Qwen2.5-7B-Instruct")
         display_name: Human-readable name for the model
-        endpoint: Optional external vLLM endpoint URL. If None, uses HF Inference API
+        endpoint: Optional external vLLM endpoint URL, or a list of replica URLs. If None, uses HF Inference API
+        context_budget: Optional prompt token budget. If None, uses DEFAULT_CONTEXT_BUDGET
+        concurrency: Optional concurrent request limit. If None, uses DEFAULT_MODEL_CONCURRENCY
+        hedging: Optional, True to hedge slow requests to a second endpoint. Off by default
     
     Example:
         add_model("mistralai/Mistral-7B-Instruct-v0.2", "Mistral 7B Instruct")
         add_model("Qwen/Qwen2.5-32B", "Qwen 32B", "https://my-endpoint.com")
+        add_model("Qwen/Qwen2.5-32B", "Qwen 32B", ["https://replica-1.com", "https://replica-2.com"])
     """
     AVAILABLE_MODELS[model_id] = display_name
     
     if endpoint:
+        endpoints = [endpoint] if isinstance(endpoint, str) else list(endpoint)
         MODEL_ROUTING[model_id] = {
-            "endpoint": endpoint,
+            "endpoint": endpoints[0],
+            "endpoints": endpoints,
             "model_name": model_id
         }
+    if context_budget is not None:
+        MODEL_CONTEXT_BUDGETS[model_id] = context_budget
+    if concurrency is not None:
+        MODEL_CONCURRENCY_LIMITS[model_id] = concurrency
+    if hedging is not None:
+        MODEL_HEDGING[model_id] = hedging
+    _notify_config_change(model_id)
 
 # Helper function to remove a model
 def remove_model(model_id: str):
@@ -48,11 +126,24 @@ def remove_model(model_id: str):
         del AVAILABLE_MODELS[model_id]
     if model_id in MODEL_ROUTING:
         del MODEL_ROUTING[model_id]
+    MODEL_CONTEXT_BUDGETS.pop(model_id, None)
+    MODEL_CONCURRENCY_LIMITS.pop(model_id, None)
+    MODEL_HEDGING.pop(model_id, None)
+    _notify_config_change(model_id)
 
 # Helper function to update an endpoint
 def update_endpoint(model_id: str, new_endpoint: str):
     """Update the endpoint for an external model"""
+    update_endpoints(model_id, [new_endpoint])
+
+# Helper function to replace the replicas of a model
+def update_endpoints(model_id: str, new_endpoints: List[str]):
+    """Replace the replica endpoints of an external model"""
+    if not new_endpoints:
+        raise ValueError("At least one endpoint is required")
     if model_id in MODEL_ROUTING:
-        MODEL_ROUTING[model_id]["endpoint"] = new_endpoint
+        MODEL_ROUTING[model_id]["endpoint"] = new_endpoints[0]
+        MODEL_ROUTING[model_id]["endpoints"] = list(new_endpoints)
+        _notify_config_change(model_id)
     else:
         raise ValueError(f"Model {model_id} is not configured for external routing")
\ No newline at end of file
@@ -0,0 +1,8 @@
+from utils.output_store import read_spilled_output, READ_OUTPUT_MAX_LENGTH
+
+def read_output(service_id: str, ref: str, offset: int = 0, length: int = READ_OUTPUT_MAX_LENGTH) -> str:
+    """
+    Page through a tool output that was too long to return in full.
+    """
+    print(f"Reading output {ref} of sandbox {service_id} (offset={offset}, length={length})")
+    return read_spilled_output(service_id, ref, offset, length)
@@ -1,7 +1,8 @@
 import os
 import asyncio
 from typing import Optional
-from koyeb import Sandbox
+from utils.sandbox_registry import get_sandbox
+from utils.process_registry import record_launch, get_process
 
 # Import from the new websocket utils module
 from utils.websocket_utils import broadcast_log, queue_log_for_broadcast
@@ -42,7 +43,7 @@ def run_background_command(service_id: str, command: str, timeout: int = 300, lo
         safe_broadcast(broadcast_to, "command_error", f"❌ {error_msg}")
         raise ValueError(error_msg)
 
-    sandbox = Sandbox.get_from_id(service_id, api_token=api_token)
+    sandbox = get_sandbox(service_id, api_token=api_token)
     if not sandbox:
         error_msg = f"Sandbox with ID {service_id} not found"
         safe_broadcast(broadcast_to, "command_error", f"❌ {error_msg}")
@@ -62,18 +63,11 @@ def run_background_command(service_id: str, command: str, timeout: int = 300, lo
             {"process_id": process_id, "command": command}
         )
         
-        # Wait a moment for process to initialize
-        import time
-        time.sleep(2)
+        # Track the launch so later process checks don't need to list processes again
+        record_launch(service_id, process_id, command)
         
-        # Get process status
-        processes = sandbox.list_processes()
-        process_info = None
-        
-        for process in processes:
-            if process.id == process_id:
-                process_info = process
-                break
+        # Get process status (readiness is probed by the caller, no fixed wait here)
+        process_info = get_process(service_id, process_id, api_token=api_token)
         
         if process_info:
             safe_broadcast(
@@ -1,10 +1,13 @@
 import os
 import asyncio
 from typing import Optional
-from koyeb import Sandbox
+from utils.sandbox_registry import get_sandbox
+from utils.process_registry import invalidate_processes
+from utils.file_cache import invalidate_files
+from utils.project_tree import invalidate_tree
 
 # Import from the new websocket utils module
-from utils.websocket_utils import broadcast_log, queue_log_for_broadcast
+from utils.websocket_utils import broadcast_log, queue_log_for_broadcast, LogBatcher
 
 def run_command(service_id: str, command: str, timeout: int = 300, log_service_id: Optional[str] = None) -> str:
     """
@@ -42,33 +45,33 @@ def run_command(service_id: str, command: str, timeout: int = 300, log_service_i
         safe_broadcast(broadcast_to, "command_error", f"❌ {error_msg}")
         raise ValueError(error_msg)
 
-    sandbox = Sandbox.get_from_id(service_id, api_token=api_token)
+    sandbox = get_sandbox(service_id, api_token=api_token)
     if not sandbox:
         error_msg = f"Sandbox with ID {service_id} not found"
         safe_broadcast(broadcast_to, "command_error", f"❌ {error_msg}")
         raise ValueError(error_msg)
 
     try:
+        # Coalesce streamed stdout into batched frames instead of one frame per chunk
+        stdout_batcher = LogBatcher(safe_broadcast, broadcast_to, "command_output", {"output_type": "stdout"})
+        
         # Execute command
-        result = sandbox.exec(command, timeout=timeout, on_stdout=lambda data:                     safe_broadcast(
-                        broadcast_to,
-                        "command_output",
-                        data.strip(),
-                        {"output_type": "stdout"}
-                    ))
+        try:
+            result = sandbox.exec(command, timeout=timeout, on_stdout=stdout_batcher.add)
+        finally:
+            stdout_batcher.close()
+            # Arbitrary commands can start or kill processes and change any file
+            invalidate_processes(service_id)
+            invalidate_files(service_id)
+            invalidate_tree(service_id)
         
-        # Broadcast output line by line
-        if result.stdout:
-            lines = result.stdout.split('\n')
-            for i, line in enumerate(lines):
-                if line.strip():  # Only send non-empty lines
-                    safe_broadcast(
-                        broadcast_to,
-                        "command_output",
-                        line,
-                        {"output_type": "stdout"}
-                    )
-        else:
+        # Only replay stdout if nothing was streamed, otherwise every line is sent twice
+        if result.stdout and not stdout_batcher.chunk_count:
+            replay_batcher = LogBatcher(safe_broadcast, broadcast_to, "command_output", {"output_type": "stdout"})
+            for line in result.stdout.splitlines(keepends=True):
+                replay_batcher.add(line)
+            replay_batcher.close()
+        elif not result.stdout:
             print("[DEBUG] No stdout from command")
         
         # Broadcast errors if any
@@ -1,8 +1,57 @@
 import asyncio
 from utils.websocket_utils import broadcast_log
 import json
+import time
 from typing import AsyncGenerator, Dict, Any
 from start_app import set_up_environment
+from utils.tool_executor import run_in_tool_executor, get_tool_timeout
+from utils.tool_call_assembler import ToolCallAssembler
+from utils.tool_scheduler import ToolCallScheduler
+from utils.sandbox_pool import sandbox_pool
+from utils.context_compaction import compact_messages
+from utils.output_store import BOUNDED_OUTPUT_TOOLS, bound_output
+from utils.session_store import get_session, save_session
+from utils.prompt_prefix import PROMPT_PREFIX_CHECK, check_prompt_prefix
+from utils.model_scheduler import ModelQueueFullError, acquire_model_slot, MODEL_QUEUE_POLL_INTERVAL, MODEL_QUEUE_TIMEOUT
+from model_config import get_context_budget
+
+
+# Never interpolate per-session values into SYSTEM_PROMPT: together with the tools schema
+# it is the prompt prefix shared by every request, which vLLM's prefix cache reuses
+SYSTEM_PROMPT = """You are a helpful coding assistant that can create and manage sandboxes and their React applications running on Vite and TypeScript (.tsx files).
+
+CRITICAL RULES:
+- ALWAYS use the exact sandbox service_id given in the session message below
+- DO NOT make up or modify the service_id
+- Perform all steps required to complete the user request
+- ALWAYS use tools to perform actions rather than describing them
+- Only provide a final summary AFTER all tools have been executed
+
+TOOLS:
+1. set_up_environment - Set up the sandbox environment with necessary installations
+2. run_command - Execute shell commands in the sandbox
+3. read_file - Read contents of files in the sandbox
+4. create_file_and_add_code - Create or modify a single file in the sandbox
+5. write_files - Create or modify several files in one call
+6. apply_patch - Make small changes to an existing file with a diff or search/replace edits
+7. start_app - Start the React application in the sandbox and expose the endpoint
+8. read_output - Page through a long tool output that was truncated
+
+The environment resets with every command you make. When running shell commands, you must combine and run all commands as a single command string.
+Only create files or projects in the /tmp directory.
+
+When the user asks you to create something:
+
+1. Use set_up_environment (ONLY ONCE at start)
+2. Call read_file to get the current value of any files you need to modify. That way you're not just overriding files blindly.
+3. Call write_files to create or rewrite all the files you need in one call (or create_file_and_add_code for a single file). For small changes to an existing file, use apply_patch instead of resending the whole file. Only make the specific update requested, and leave the remaining code. If the file already has functionality, don't override it unless requested.
+4. After all files are created, call start_app (ONLY ONCE). Do not try to run your own separate start commands.
+5. Provide a brief summary with the URL
+
+DO NOT describe your plan - execute it directly with tools."""
+
+SESSION_PROMPT_TEMPLATE = """IMPORTANT: The sandbox service_id for this session is: {service_id}
+ALWAYS use this exact service_id."""
 
 
 def execute_tool_call(tool_call, service_id, log_service_id=None):
@@ -15,9 +64,10 @@ def execute_tool_call(tool_call, service_id, log_service_id=None):
     
     # Import tool functions
     from run_command import run_command
-    from generate_files import create_file_and_add_code, read_file
+    from generate_files import create_file_and_add_code, write_files, apply_patch, read_file
     from start_app import start_app
     from expose_endpoint import expose_endpoint
+    from read_output import read_output
     
     # CRITICAL FIX: Always use the service_id passed to this function, not from arguments
     # The model might hallucinate names, so we override with the real UUID
@@ -30,9 +80,12 @@ def execute_tool_call(tool_call, service_id, log_service_id=None):
         "set_up_environment": set_up_environment,
         "run_command": run_command,
         "create_file_and_add_code": create_file_and_add_code,
+        "write_files": write_files,
+        "apply_patch": apply_patch,
         "read_file": read_file,
         "start_app": start_app,
-        "expose_endpoint": expose_endpoint
+        "expose_endpoint": expose_endpoint,
+        "read_output": read_output
     }
     
     if function_name not in function_map:
@@ -48,6 +101,10 @@ def execute_tool_call(tool_call, service_id, log_service_id=None):
         
         # Call the function with the arguments
         result = func(**arguments)
+        
+        # Cap long command outputs, the full text is kept for read_output
+        if isinstance(result, str) and function_name in BOUNDED_OUTPUT_TOOLS:
+            result = bound_output(service_id, result)
         return {"result": result}
     except Exception as e:
         error_msg = f"Error executing {function_name}: {str(e)}"
@@ -57,6 +114,29 @@ def execute_tool_call(tool_call, service_id, log_service_id=None):
         return {"error": error_msg}
 
 
+async def execute_tool_call_async(tool_call, service_id, log_service_id=None):
+    """Execute a tool call on the bounded tool executor without blocking the event loop"""
+    function_name = tool_call.function.name
+    timeout = get_tool_timeout(function_name)
+    try:
+        return await run_in_tool_executor(
+            function_name,
+            execute_tool_call,
+            tool_call,
+            service_id,
+            log_service_id,
+            timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        error_msg = f"Error executing {function_name}: timed out after {timeout:.0f} seconds"
+        print(error_msg)
+        return {"error": error_msg}
+    except Exception as e:
+        error_msg = f"Error executing {function_name}: {str(e)}"
+        print(error_msg)
+        return {"error": error_msg}
+
+
 async def process_chat_with_tools_streaming(
     client, 
     messages_dict, 
@@ -64,15 +144,34 @@ async def process_chat_with_tools_streaming(
     service_id=None, 
     max_iterations=10, 
     log_service_id=None, 
-    model=None
+    model=None,
+    session_id=None
 ) -> AsyncGenerator[Dict[str, Any], None]:  # ADD THIS TYPE HINT
     """
     Streaming version of process_chat_with_tools that yields chunks as the agent works
     
+    With a session_id, messages_dict holds only the new messages of this turn; they are
+    appended to the conversation stored for the session, which is saved again at the end.
+    
     Yields:
         Dict[str, Any]: Event chunks with different types (status, tool_calls, content, etc.)
     """
     
+    # Resume the stored conversation, unless it belongs to a different sandbox
+    history = []
+    if session_id:
+        session = get_session(session_id)
+        resumed = session is not None and (not service_id or service_id == session.service_id)
+        if resumed:
+            history = list(session.messages)
+            service_id = service_id or session.service_id
+        yield {
+            "type": "session",
+            "session_id": session_id,
+            "resumed": resumed,
+            "history_messages": len(history)
+        }
+    
     # CREATE SANDBOX IF NONE PROVIDED
     if not service_id:
         print("No service_id provided, creating new sandbox...")
@@ -83,12 +182,17 @@ async def process_chat_with_tools_streaming(
         
         from create_sandbox import create_sandbox_client
         try:
-            service_id = create_sandbox_client()
-            print(f"Created new sandbox with ID: {service_id}")
+            # Claim a pre-provisioned sandbox first, fall back to creating one
+            service_id = sandbox_pool.claim()
+            from_pool = service_id is not None
+            if not from_pool:
+                service_id = await run_in_tool_executor("create_sandbox_client", create_sandbox_client)
+            print(f"{'Claimed pooled' if from_pool else 'Created new'} sandbox with ID: {service_id}")
             
             yield {
                 "type": "sandbox_created",
                 "service_id": service_id,
+                "from_pool": from_pool,
                 "message": f"✅ Sandbox created: {service_id}"
             }
         except Exception as e:
@@ -126,42 +230,17 @@ async def process_chat_with_tools_streaming(
     
     all_tool_results = []
     current_service_id = service_id
-    conversation_messages = messages_dict.copy()
+    conversation_messages = history + messages_dict
     consecutive_errors = 0  # Track consecutive errors
     
-    # Single system prompt - prepend service_id info
-    system_prompt = f"""You are a helpful coding assistant that can create and manage sandboxes and their React applications running on Vite and TypeScript (.tsx files).
-
-IMPORTANT: The sandbox service_id is: {current_service_id}
-
-CRITICAL RULES:
-- ALWAYS use this exact service_id: {current_service_id}
-- DO NOT make up or modify the service_id
-- Perform all steps required to complete the user request
-- ALWAYS use tools to perform actions rather than describing them
-- Only provide a final summary AFTER all tools have been executed
-
-TOOLS:
-1. set_up_environment - Set up the sandbox environment with necessary installations
-2. run_command - Execute shell commands in the sandbox
-3. read_file - Read contents of files in the sandbox
-4. create_file_and_add_code - Create or modify files in the sandbox
-5. start_app - Start the React application in the sandbox and expose the endpoint
-
-The environment resets with every command you make. When running shell commands, you must combine and run all commands as a single command string.
-Only create files or projects in the /tmp directory.
-
-When the user asks you to create something:
-
-1. Use set_up_environment (ONLY ONCE at start)
-2. Call read_file to get the current value of any files you need to modify. That way you're not just overriding files blindly.
-3. Call create_file_and_add_code to modify files as needed (repeat as needed for all files). Only make the specific update requested, and leave the remaining code. If the file already has functionality, don't override it unless requested.
-4. After all files are created, call start_app (ONLY ONCE). Do not try to run your own separate start commands.
-5. Provide a brief summary with the URL
-
-DO NOT describe your plan - execute it directly with tools."""
-    
-    conversation_messages.insert(0, {"role": "system", "content": system_prompt})
+    # Static instructions first and per-session values after them, so the system prompt
+    # and tools form a byte-identical prefix that the endpoint's prefix cache can reuse
+    conversation_messages[:0] = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "system", "content": SESSION_PROMPT_TEMPLATE.format(service_id=current_service_id)},
+    ]
+    # Messages before this index are compacted; it only moves when the budget is exceeded
+    compaction_boundary = 0
     
     try:
         for iteration in range(max_iterations):
@@ -189,35 +268,126 @@ DO NOT describe your plan - execute it directly with tools."""
                 }
                 return
             
-            response = client.chat_completion(
-                model=model,
-                messages=conversation_messages,
-                tools=tools,
+            # Stream the completion: forward content deltas as they arrive and
+            # dispatch each tool call as soon as its arguments are complete
+            content_parts = []
+            assembler = ToolCallAssembler()
+            # Reads run concurrently, writes run alone in the order the model issued them
+            scheduler = ToolCallScheduler(
+                lambda tool_call: execute_tool_call_async(tool_call, current_service_id, log_service_id)
             )
-            
-            if not response.choices:
+            received_choice = False
+
+            def dispatch_tool(tool_call):
+                scheduler.schedule(tool_call)
+                return {
+                    "type": "tool_start",
+                    "tool": tool_call.function.name,
+                    "arguments": tool_call.function.arguments
+                }
+
+            # Keep the prompt within the model's budget; the full history stays in conversation_messages
+            request_messages, compaction = compact_messages(conversation_messages, get_context_budget(model), boundary=compaction_boundary)
+            compaction_boundary = compaction["boundary"]
+            if compaction["compacted_messages"] or compaction["over_budget"]:
+                print(f"[Context] Compacted {compaction['compacted_messages']} messages: ~{compaction['tokens_before']} -> ~{compaction['tokens_after']} tokens (budget {compaction['budget']})")
+
+            if PROMPT_PREFIX_CHECK:
+                prefix = check_prompt_prefix(session_id or current_service_id, request_messages, tools)
+                print(f"[PromptPrefix] prefix {prefix['prefix_hash']} (~{prefix['static_prefix_tokens']} tokens), {prefix['shared_messages']}/{prefix['messages']} messages shared with the previous request, ~{prefix['cacheable_tokens']}/{prefix['total_tokens']} tokens cacheable")
+
+            # Wait for a slot on the model's endpoint; waiting sessions are served round-robin
+            try:
+                ticket = acquire_model_slot(model, session_id or current_service_id)
+            except ModelQueueFullError as e:
+                print(f"[ModelScheduler] Rejected request: {e}")
+                yield {
+                    "type": "error",
+                    "error": str(e),
+                    "service_id": current_service_id,
+                    "retryable": True,
+                    "success": False
+                }
+                return
+
+            try:
+                last_position = None
+                while not await ticket.wait(MODEL_QUEUE_POLL_INTERVAL):
+                    if time.monotonic() - ticket.enqueued_at > MODEL_QUEUE_TIMEOUT:
+                        yield {
+                            "type": "error",
+                            "error": f"Timed out after {MODEL_QUEUE_TIMEOUT:.0f}s waiting for {model}. Please try again shortly.",
+                            "service_id": current_service_id,
+                            "retryable": True,
+                            "success": False
+                        }
+                        return
+                    position = ticket.position()
+                    if position != last_position:
+                        last_position = position
+                        yield {
+                            "type": "queued",
+                            "position": position,
+                            "model": model,
+                            "message": f"⏳ Waiting for the model (position {position} in queue)..."
+                        }
+
+                # Async client so concurrent sessions don't block the event loop
+                stream = await client.chat_completion(
+                    model=model,
+                    messages=request_messages,
+                    tools=tools,
+                    stream=True,
+                )
+
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    received_choice = True
+                    delta = chunk.choices[0].delta
+
+                    if delta.content:
+                        content_parts.append(delta.content)
+                        yield {
+                            "type": "content",
+                            "content": delta.content,
+                            "delta": delta.content
+                        }
+
+                    if delta.tool_calls:
+                        for tool_call in assembler.add(delta.tool_calls):
+                            yield dispatch_tool(tool_call)
+
+                for tool_call in assembler.finish():
+                    yield dispatch_tool(tool_call)
+            finally:
+                # Free the slot before running tools, they don't use the endpoint
+                ticket.release()
+
+            if not received_choice:
                 yield {"type": "error", "error": "No response from model"}
                 return
-            
-            message = response.choices[0].message
-            print(f"Assistant message: {message.content}")
+
+            content = "".join(content_parts) or None
+            tool_calls = assembler.tool_calls
+            print(f"Assistant message: {content}")
             
             # Check if the model wants to use tools
-            if hasattr(message, 'tool_calls') and message.tool_calls:
-                print(f"Model requested {len(message.tool_calls)} tool calls")
-                print(f"Tool calls: {[tool_call.function.name for tool_call in message.tool_calls]}")
+            if tool_calls:
+                print(f"Model requested {len(tool_calls)} tool calls")
+                print(f"Tool calls: {[tool_call.function.name for tool_call in tool_calls]}")
                 
                 # Yield tool call info
                 yield {
                     "type": "tool_calls",
-                    "count": len(message.tool_calls),
-                    "tools": [tc.function.name for tc in message.tool_calls]
+                    "count": len(tool_calls),
+                    "tools": [tc.function.name for tc in tool_calls]
                 }
                 
                 # Add assistant message with tool_calls
                 assistant_message = {
                     "role": "assistant", 
-                    "content": message.content or "Working on your request...",
+                    "content": content or "Working on your request...",
                     "tool_calls": [
                         {
                             "id": tc.id,
@@ -227,22 +397,15 @@ DO NOT describe your plan - execute it directly with tools."""
                                 "arguments": tc.function.arguments
                             }
                         }
-                        for tc in message.tool_calls
+                        for tc in tool_calls
                     ]
                 }
                 conversation_messages.append(assistant_message)
                 
-                # Execute each tool call
+                # Collect tool results in the order the model requested them
                 has_errors = False
-                for tool_call in message.tool_calls:
-                    # Yield tool execution start
-                    yield {
-                        "type": "tool_start",
-                        "tool": tool_call.function.name,
-                        "arguments": tool_call.function.arguments
-                    }
-                    
-                    result = execute_tool_call(tool_call, current_service_id, log_service_id)
+                for tool_call in tool_calls:
+                    result = await scheduler.result(tool_call)
                     print(f"Tool {tool_call.function.name} result: {result}")
                     
                     # Yield tool result
@@ -302,17 +465,18 @@ DO NOT describe your plan - execute it directly with tools."""
                         elif len(all_tool_results) >= 1:
                             # Check what we've accomplished
                             recent_tools = [r['function_name'] for r in all_tool_results[-3:]]
+                            wrote_files = any(tool in recent_tools for tool in ('create_file_and_add_code', 'write_files', 'apply_patch'))
                             
                             # If we've only run basic setup, continue
-                            if 'run_command' in recent_tools and 'create_file_and_add_code' not in recent_tools:
+                            if 'run_command' in recent_tools and not wrote_files:
                                 needs_continuation = True
                             
                             # If we've read files but haven't created or modified them
-                            elif 'read_file' in recent_tools and 'create_file_and_add_code' not in recent_tools:
+                            elif 'read_file' in recent_tools and not wrote_files:
                                 needs_continuation = True
 
                             # If we've created files but haven't exposed/finished
-                            elif 'create_file_and_add_code' in recent_tools and 'start_app' not in recent_tools:
+                            elif wrote_files and 'start_app' not in recent_tools:
                                 needs_continuation = True
                     
                     if needs_continuation:
@@ -345,22 +509,13 @@ DO NOT describe your plan - execute it directly with tools."""
                     }
                     continue
                 
-                # Stream the final content token by token
-                if message.content:
-                    words = message.content.split()
-                    for i, word in enumerate(words):
-                        yield {
-                            "type": "content",
-                            "content": word + (" " if i < len(words) - 1 else ""),
-                            "delta": word + (" " if i < len(words) - 1 else "")
-                        }
-                        await asyncio.sleep(0.01)  # Small delay for streaming effect
-                
-                # Return final response
+                # Final content was already streamed as it arrived
                 consecutive_errors = 0
+                if content:
+                    conversation_messages.append({"role": "assistant", "content": content})
                 yield {
                     "type": "complete",
-                    "content": message.content,
+                    "content": content,
                     "service_id": current_service_id,
                     "tool_calls": all_tool_results if all_tool_results else None,
                     "tool_results": all_tool_results,
@@ -391,4 +546,8 @@ DO NOT describe your plan - execute it directly with tools."""
             "service_id": current_service_id,
             "tool_results": all_tool_results,
             "success": False
-        }
\ No newline at end of file
+        }
+    finally:
+        # Keep the tool context for the next turn, also when the client went away mid-stream
+        if session_id:
+            save_session(session_id, current_service_id, conversation_messages, get_context_budget(model), compaction_boundary)
\ No newline at end of file
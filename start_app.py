@@ -1,5 +1,6 @@
 from koyeb import Sandbox
 import os
+import time
 import asyncio
 from typing import Optional, Tuple
 from generate_files import create_file_and_add_code
@@ -9,6 +10,39 @@ from expose_endpoint import expose_endpoint
 from utils.websocket_utils import broadcast_log, queue_log_for_broadcast
 from run_background_command import run_background_command
 from check_vite_process import check_vite_process
+from utils.sandbox_registry import get_sandbox
+from utils.readiness import wait_for_server_ready, to_url, SERVER_READY_TIMEOUT
+from utils.template_cache import template_version, has_template, restore_template, ensure_template
+from utils.file_cache import invalidate_files
+from utils.project_tree import invalidate_tree
+
+# Combined setup command that does everything in one shot
+SETUP_COMMAND = """
+    # Install Node.js and npm
+    curl -fsSL https://deb.nodesource.com/setup_20.x | bash - && \
+    apt-get install -y nodejs && \
+    
+    # Verify installations
+    node --version && \
+    npm --version && \
+    
+    # Create React app with Vite in /tmp/my-project
+    cd /tmp && \
+    npm create vite@latest my-project -- --template react-ts && \
+    
+    # Install dependencies
+    cd /tmp/my-project && \
+    npm install && \
+    
+    # Install Tailwind CSS
+    npm install -D tailwindcss postcss autoprefixer && \
+    npx tailwindcss init -p && \
+    
+    echo "Setup complete!"
+    """
+
+# Cached project templates are keyed by this hash, so editing SETUP_COMMAND rebuilds them
+TEMPLATE_VERSION = template_version(SETUP_COMMAND)
 
 def set_up_environment(service_id: str, log_service_id=None):
     """
@@ -40,33 +74,44 @@ Setup was previously completed. Ready to modify files."""
             print(f"[set_up_environment] Warning: Could not check for existing Vite process: {e}")
             # Continue with setup anyway
     
-    # Combined setup command that does everything in one shot
-    setup_command = """
-    # Install Node.js and npm
-    curl -fsSL https://deb.nodesource.com/setup_20.x | bash - && \
-    apt-get install -y nodejs && \
-    
-    # Verify installations
-    node --version && \
-    npm --version && \
-    
-    # Create React app with Vite in /tmp/my-project
-    cd /tmp && \
-    npm create vite@latest my-project -- --template react-ts && \
-    
-    # Install dependencies
-    cd /tmp/my-project && \
-    npm install && \
-    
-    # Install Tailwind CSS
-    npm install -D tailwindcss postcss autoprefixer && \
-    npx tailwindcss init -p && \
+        # Restore the pre-built project (node_modules included) from the template cache
+        try:
+            if has_template(TEMPLATE_VERSION):
+                sandbox = get_sandbox(service_id, api_token=api_token)
+                queue_log_for_broadcast(
+                    broadcast_to,
+                    "command_start",
+                    f"📦 Restoring cached project template {TEMPLATE_VERSION}...",
+                    {"template_version": TEMPLATE_VERSION}
+                )
+                restored = restore_template(sandbox, TEMPLATE_VERSION)
+                # The extract overwrote the project, whether or not it completed
+                invalidate_files(service_id)
+                invalidate_tree(service_id)
+                if restored:
+                    queue_log_for_broadcast(
+                        broadcast_to,
+                        "command_complete",
+                        "✅ Project template restored",
+                        {"template_version": TEMPLATE_VERSION}
+                    )
+                    return f"""✅ Environment set up from cached template {TEMPLATE_VERSION}!
+
+Node.js and npm: Installed
+React + Vite project: Created at /tmp/my-project
+Dependencies: Installed (including Tailwind CSS)
+
+Ready to modify files."""
+        except Exception as e:
+            print(f"[set_up_environment] Warning: Could not restore project template: {e}")
+            # Fall back to a full setup
     
-    echo "Setup complete!"
-    """
+    # Build the template in a clean sandbox of its own so later sessions can skip the install
+    if api_token:
+        ensure_template(TEMPLATE_VERSION, SETUP_COMMAND)
     
     try:
-        result = run_command(service_id, setup_command, log_service_id=broadcast_to)
+        result = run_command(service_id, SETUP_COMMAND, log_service_id=broadcast_to)
         print(f"[set_up_environment] Setup completed: {result[:200]}...")
         return result
     except Exception as e:
@@ -206,6 +251,7 @@ export default defineConfig({
         )
 
         # Use the background command runner
+        launch_started = time.monotonic()
         start_result = run_background_command(
             service_id, 
             'cd /tmp/my-project && npm run dev -- --host 0.0.0.0 --port 80',
@@ -214,38 +260,56 @@ export default defineConfig({
 
         print(f"Background server start result: {start_result}")
 
-        # Give the server a moment to start
+        # Step 4: Get the public URL
+        sandbox_url = get_sandbox_url(service_id)
+
+        # Probe the server until it actually answers instead of sleeping a fixed time
         safe_broadcast(
             broadcast_to,
             "server_starting",
-            "⏳ Waiting for server to initialize...",
-            {"wait_time": "3 seconds"}
+            "⏳ Waiting for server to answer...",
+            {"url": to_url(sandbox_url), "timeout": SERVER_READY_TIMEOUT}
         )
 
-        import time
-        time.sleep(3)
+        def is_process_alive() -> bool:
+            is_running, _, status = check_vite_process(service_id, api_token)
+            # Don't fail the probe because the process check itself errored
+            return is_running or status == "error"
+
+        if sandbox_url:
+            ready, _, ready_detail = wait_for_server_ready(to_url(sandbox_url), is_process_alive)
+        else:
+            ready, ready_detail = False, "sandbox has no public domain"
+        startup_time = time.monotonic() - launch_started
 
-        # Check if process is now running using our abstracted function
+        # Check the process state for the report
         is_running, vite_process, process_status = check_vite_process(service_id, api_token)
 
-        if is_running and vite_process:
+        if ready:
+            process_status = "ready"
             safe_broadcast(
                 broadcast_to,
                 "server_ready",
-                "✅ Development server is running",
-                {"process_id": vite_process.id, "status": process_status}
+                f"✅ Development server is ready ({startup_time:.1f}s)",
+                {
+                    "process_id": vite_process.id if vite_process else None,
+                    "status": process_status,
+                    "startup_ms": round(startup_time * 1000),
+                    "probe": ready_detail
+                }
             )
         else:
             safe_broadcast(
                 broadcast_to,
                 "server_warning",
-                "⚠️ Server may still be starting...",
-                {"status": process_status}
+                f"⚠️ Development server is not answering: {ready_detail}",
+                {
+                    "status": process_status,
+                    "waited_ms": round(startup_time * 1000),
+                    "probe": ready_detail
+                }
             )
         
-        # Step 4: Get the public URL
-        sandbox_url = get_sandbox_url(service_id)
-        
         safe_broadcast(
             broadcast_to,
             "app_complete",
@@ -257,7 +321,7 @@ export default defineConfig({
 
 Vite Config: Updated with external access enabled
 Port 80: {expose_result}
-Dev Server: {process_status}
+Dev Server: {process_status}{f' (answered after {startup_time:.1f}s)' if ready else f' - {ready_detail}'}
 Process ID: {vite_process.id if vite_process else 'Unknown'}
 Public URL: {sandbox_url}
 
@@ -0,0 +1,57 @@
+import pytest
+
+from utils.patching import PatchError, apply_search_replace, apply_unified_diff
+
+
+def test_add_lines_to_empty_file():
+    content, hunks = apply_unified_diff("", "@@ -0,0 +1,2 @@\n+x\n+y\n")
+    assert content == "x\ny\n"
+    assert hunks == 1
+
+
+def test_new_file_with_file_headers():
+    diff = "--- /dev/null\n+++ b/src/new.ts\n@@ -0,0 +1,3 @@\n+export const a = 1;\n+\n+export const b = 2;\n"
+    content, _ = apply_unified_diff("", diff)
+    assert content == "export const a = 1;\n\nexport const b = 2;\n"
+
+
+def test_replace_line_keeps_trailing_newline():
+    original = "one\ntwo\nthree\n"
+    content, _ = apply_unified_diff(original, "@@ -1,3 +1,3 @@\n one\n-two\n+TWO\n three\n")
+    assert content == "one\nTWO\nthree\n"
+
+
+def test_removing_every_line_leaves_empty_file():
+    content, _ = apply_unified_diff("a\nb\n", "@@ -1,2 +0,0 @@\n-a\n-b\n")
+    assert content == ""
+
+
+def test_mismatched_hunk_raises():
+    with pytest.raises(PatchError):
+        apply_unified_diff("one\ntwo\n", "@@ -1,2 +1,2 @@\n one\n-zwei\n+TWO\n")
+
+
+def test_search_replace_requires_unique_match():
+    with pytest.raises(PatchError):
+        apply_search_replace("a\na\n", [{"search": "a", "replace": "b"}])
+    content, _ = apply_search_replace("a\nb\n", [{"search": "b", "replace": "c"}])
+    assert content == "a\nc\n"
+
+
+def test_added_line_starting_with_plus_signs_is_kept():
+    content, _ = apply_unified_diff("a\nb\n", "@@ -1,2 +1,3 @@\n a\n+++ x\n b\n")
+    assert content == "a\n++ x\nb\n"
+
+
+def test_removed_comment_line_starting_with_dashes():
+    original = "SELECT 1;\n-- old comment\nSELECT 2;\n"
+    diff = "@@ -1,3 +1,2 @@\n SELECT 1;\n--- old comment\n SELECT 2;\n"
+    content, _ = apply_unified_diff(original, diff)
+    assert content == "SELECT 1;\nSELECT 2;\n"
+
+
+def test_file_headers_between_hunks_are_skipped():
+    diff = "--- a/f\n+++ b/f\n@@ -1,1 +1,1 @@\n-a\n+A\n--- a/f\n+++ b/f\n@@ -3,1 +3,1 @@\n-c\n+C\n"
+    content, hunks = apply_unified_diff("a\nb\nc\n", diff)
+    assert content == "A\nb\nC\n"
+    assert hunks == 2
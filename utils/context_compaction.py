@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, List
+
+# Rough token estimate: characters per token, plus a fixed overhead per message for role/formatting
+CONTEXT_CHARS_PER_TOKEN = float(os.getenv("CONTEXT_CHARS_PER_TOKEN", "4"))
+CONTEXT_MESSAGE_OVERHEAD_TOKENS = 4
+
+# Trailing messages that are always sent verbatim
+CONTEXT_KEEP_RECENT_MESSAGES = int(os.getenv("CONTEXT_KEEP_RECENT_MESSAGES", "6"))
+
+# Once over budget, compact down to this fraction of it, so the compacted part of the
+# prompt then stays the same (and prefix-cacheable) for several requests
+CONTEXT_LOW_WATER_RATIO = float(os.getenv("CONTEXT_LOW_WATER_RATIO", "0.7"))
+
+# Older tool results are cut down to this much head and tail text
+CONTEXT_DIGEST_HEAD_CHARS = int(os.getenv("CONTEXT_DIGEST_HEAD_CHARS", "400"))
+CONTEXT_DIGEST_TAIL_CHARS = int(os.getenv("CONTEXT_DIGEST_TAIL_CHARS", "400"))
+
+# Tool call argument strings longer than this (file contents, diffs) are replaced by a placeholder
+CONTEXT_MAX_ARGUMENT_CHARS = int(os.getenv("CONTEXT_MAX_ARGUMENT_CHARS", "200"))
+
+_DIGEST_MARKER = "chars omitted from an earlier tool result"
+# Texts at most this much over head + tail are kept whole, which also leaves digests as they are
+_DIGEST_SLACK_CHARS = 100
+
+_lock = threading.Lock()
+_stats = {
+    "requests": 0,
+    "compacted": 0,
+    "over_budget": 0,
+    "tokens_before": 0,
+    "tokens_after": 0,
+}
+
+
+def estimate_tokens(message: Dict[str, Any]) -> int:
+    """Approximate token count of one chat message"""
+    chars = len(message.get("content") or "")
+    for tool_call in message.get("tool_calls") or []:
+        function = tool_call.get("function", {})
+        chars += len(function.get("name") or "") + len(function.get("arguments") or "")
+    return int(chars / CONTEXT_CHARS_PER_TOKEN) + CONTEXT_MESSAGE_OVERHEAD_TOKENS
+
+
+def estimate_messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(estimate_tokens(message) for message in messages)
+
+
+def digest_text(text: str, head: int = CONTEXT_DIGEST_HEAD_CHARS, tail: int = CONTEXT_DIGEST_TAIL_CHARS) -> str:
+    """Head and tail of a long text with the omitted middle summarized"""
+    if len(text) <= head + tail + _DIGEST_SLACK_CHARS:
+        return text
+    omitted = len(text) - head - tail
+    return f"{text[:head]}\n[... {omitted} {_DIGEST_MARKER} ...]\n{text[-tail:]}"
+
+
+def _digest_value(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > CONTEXT_MAX_ARGUMENT_CHARS:
+        sha = hashlib.sha256(value.encode("utf-8")).hexdigest()[:16]
+        return f"<{len(value)} chars omitted, sha256 {sha}>"
+    if isinstance(value, list):
+        return [_digest_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _digest_value(item) for key, item in value.items()}
+    return value
+
+
+def digest_arguments(arguments: str) -> str:
+    """Tool call arguments with long string values (file contents, diffs) replaced by placeholders"""
+    try:
+        parsed = json.loads(arguments)
+    except (TypeError, ValueError):
+        return digest_text(arguments or "")
+    return json.dumps(_digest_value(parsed))
+
+
+def _compact_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    if message.get("role") == "tool":
+        return {**message, "content": digest_text(message.get("content") or "")}
+    if message.get("role") == "assistant" and message.get("tool_calls"):
+        return {
+            **message,
+            "tool_calls": [
+                {
+                    **tool_call,
+                    "function": {
+                        **tool_call["function"],
+                        "arguments": digest_arguments(tool_call["function"].get("arguments")),
+                    },
+                }
+                for tool_call in message["tool_calls"]
+            ],
+        }
+    # System and user messages are kept as they are
+    return message
+
+
+def compact_messages(messages: List[Dict[str, Any]], budget: int, keep_recent: int = CONTEXT_KEEP_RECENT_MESSAGES, boundary: int = 0) -> tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Fit a conversation into a token budget before sending it to the model.
+
+    Messages are never dropped or reordered, so tool calls stay paired with their results.
+    Tool results before boundary are replaced by head/tail digests and long tool call
+    arguments by placeholders. If that is still over budget, the boundary moves forward
+    (never into the recent window) until the estimate is under the low-water mark.
+    Pass back info["boundary"] on the next call of the same conversation so the compacted
+    prefix only changes when the budget is exceeded again.
+    The input list is not modified; returns (messages_to_send, info).
+    """
+    tokens = [estimate_tokens(message) for message in messages]
+    before = sum(tokens)
+    total = before
+    compacted = list(messages)
+    count = 0
+    limit = max(len(messages) - keep_recent, 0)
+    boundary = min(max(boundary, 0), limit) if budget else 0
+
+    def compact(index: int):
+        nonlocal total, count
+        replacement = _compact_message(messages[index])
+        if replacement is messages[index]:
+            return
+        new_tokens = estimate_tokens(replacement)
+        if new_tokens >= tokens[index]:
+            return
+        compacted[index] = replacement
+        total -= tokens[index] - new_tokens
+        count += 1
+
+    for index in range(boundary):
+        compact(index)
+    if budget and total > budget:
+        low_water = budget * CONTEXT_LOW_WATER_RATIO
+        while boundary < limit and total > low_water:
+            compact(boundary)
+            boundary += 1
+
+    info = {
+        "tokens_before": before,
+        "tokens_after": total,
+        "budget": budget,
+        "boundary": boundary,
+        "compacted_messages": count,
+        "over_budget": bool(budget) and total > budget,
+    }
+    with _lock:
+        _stats["requests"] += 1
+        _stats["tokens_before"] += before
+        _stats["tokens_after"] += total
+        if count:
+            _stats["compacted"] += 1
+        if info["over_budget"]:
+            _stats["over_budget"] += 1
+    return compacted, info
+
+
+def get_compaction_stats() -> Dict[str, Any]:
+    """Compaction counters for debugging"""
+    with _lock:
+        return {
+            "keep_recent_messages": CONTEXT_KEEP_RECENT_MESSAGES,
+            **_stats,
+        }
@@ -0,0 +1,322 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+
+from model_config import MODEL_ROUTING, get_model_endpoints, register_config_listener
+
+# Consecutive failures (requests or health checks) that eject a replica, and how long it stays out
+# before a single trial request is let through again
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+CIRCUIT_COOLDOWN = float(os.getenv("CIRCUIT_COOLDOWN", "30"))
+# Background health checks of every replica, 0 disables them
+ENDPOINT_HEALTH_INTERVAL = float(os.getenv("ENDPOINT_HEALTH_INTERVAL", "15"))
+ENDPOINT_HEALTH_TIMEOUT = float(os.getenv("ENDPOINT_HEALTH_TIMEOUT", "5"))
+ENDPOINT_HEALTH_PATH = os.getenv("ENDPOINT_HEALTH_PATH", "/health")
+# Weight of the newest sample in the latency moving average
+ENDPOINT_LATENCY_ALPHA = float(os.getenv("ENDPOINT_LATENCY_ALPHA", "0.3"))
+# Latency sample recorded for a failed request, unless it took even longer
+ENDPOINT_FAILURE_LATENCY = float(os.getenv("ENDPOINT_FAILURE_LATENCY", "10"))
+
+HF_TOKEN = os.getenv("HF_TOKEN")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class EndpointState:
+    """Load, latency and circuit breaker state of one model replica"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.state = CLOSED
+        self.outstanding = 0
+        # Moving average of seconds to the first streamed chunk (whole response when not streaming)
+        self.latency: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_chosen = 0.0
+        self.healthy: Optional[bool] = None
+        self.last_health_check: Optional[float] = None
+
+    def observe(self, latency: float):
+        """Fold a latency sample into the moving average"""
+        self.latency = latency if self.latency is None else (
+            ENDPOINT_LATENCY_ALPHA * latency + (1 - ENDPOINT_LATENCY_ALPHA) * self.latency
+        )
+
+    def available(self, now: float) -> bool:
+        if self.state == OPEN and now - self.opened_at >= CIRCUIT_COOLDOWN:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            # One trial request at a time decides whether the replica is back
+            return self.outstanding == 0
+        return self.state == CLOSED
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "state": self.state,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "latency_seconds": round(self.latency, 3) if self.latency is not None else None,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "seconds_since_health_check": round(time.monotonic() - self.last_health_check, 1) if self.last_health_check else None,
+        }
+
+
+# model -> endpoint url -> state, kept in line with MODEL_ROUTING
+_endpoints: Dict[str, Dict[str, EndpointState]] = {}
+_lock = threading.Lock()
+_health_task: Optional[asyncio.Task] = None
+
+_stats = {
+    "chosen": 0,
+    "circuit_opened": 0,
+    "circuit_closed": 0,
+    "all_open_fallbacks": 0,
+    "health_checks": 0,
+    "health_check_failures": 0,
+}
+
+
+def _states(model: str) -> Dict[str, EndpointState]:
+    """Endpoint states of model, synced with its configured endpoints. Call with _lock held."""
+    urls = get_model_endpoints(model)
+    states = _endpoints.get(model, {})
+    if list(states) != urls:
+        states = {url: states.get(url) or EndpointState(url) for url in urls}
+        _endpoints[model] = states
+    return states
+
+
+def choose_endpoint(model: str, exclude: Iterable[str] = ()) -> Optional[str]:
+    """
+    Replica for the next request to model: the fewest outstanding requests, then the lowest
+    latency, among replicas whose circuit is closed (or half-open and free for a trial).
+    Returns None for models without external endpoints.
+    """
+    exclude = set(exclude)
+    now = time.monotonic()
+    with _lock:
+        states = [state for url, state in _states(model).items() if url not in exclude]
+        if not states:
+            return None
+        candidates = [state for state in states if state.available(now)]
+        if not candidates:
+            # Every replica is ejected: better to try the one that failed longest ago than to fail outright
+            _stats["all_open_fallbacks"] += 1
+            candidates = [min(states, key=lambda state: state.opened_at or 0.0)]
+            print(f"[EndpointBalancer] All endpoints of {model} are open, trying {candidates[0].url}")
+        # A replica never tried gets one probe request; one still unmeasured after that
+        # ranks at the median of the measured ones instead of winning every tie
+        measured = sorted(state.latency for state in states if state.latency is not None)
+        median = measured[len(measured) // 2] if measured else 0.0
+
+        def expected_latency(state: EndpointState) -> float:
+            if state.latency is not None:
+                return state.latency
+            return 0.0 if state.requests == 0 else median
+
+        chosen = min(
+            candidates,
+            key=lambda state: (state.outstanding, expected_latency(state), state.last_chosen),
+        )
+        chosen.last_chosen = now
+        _stats["chosen"] += 1
+        return chosen.url
+
+
+def record_start(model: str, endpoint: Optional[str]):
+    """Count a request against endpoint until record_success or record_failure"""
+    with _lock:
+        state = _states(model).get(endpoint) if endpoint else None
+        if state is not None:
+            state.outstanding += 1
+            state.requests += 1
+
+
+def _open(model: str, state: EndpointState, reason: str):
+    if state.state != OPEN:
+        _stats["circuit_opened"] += 1
+        print(f"[EndpointBalancer] Ejecting {state.url} ({model}): {reason}")
+    state.state = OPEN
+    state.opened_at = time.monotonic()
+
+
+def _mark_failure(model: str, state: EndpointState, error: str):
+    state.failures += 1
+    state.consecutive_failures += 1
+    state.last_error = error
+    if state.state == HALF_OPEN or state.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+        _open(model, state, error)
+
+
+def record_success(model: str, endpoint: Optional[str], latency: Optional[float] = None):
+    """Finish a request that got a response; closes a half-open circuit"""
+    with _lock:
+        state = _states(model).get(endpoint) if endpoint else None
+        if state is None:
+            return
+        state.outstanding = max(state.outstanding - 1, 0)
+        state.consecutive_failures = 0
+        if latency is not None:
+            state.observe(latency)
+        if state.state != CLOSED:
+            state.state = CLOSED
+            state.opened_at = None
+            _stats["circuit_closed"] += 1
+            print(f"[EndpointBalancer] Re-admitted {endpoint} ({model})")
+
+
+def record_failure(model: str, endpoint: Optional[str], error: Any, counts: bool = True, elapsed: Optional[float] = None):
+    """
+    Finish a failed request. counts=False for errors that say nothing about the replica's
+    health (e.g. a 4xx for a bad request), which only release the outstanding slot.
+    Counted failures also add a latency sample of at least ENDPOINT_FAILURE_LATENCY, so a
+    replica that never answers can't keep the latency of its last success.
+    """
+    with _lock:
+        state = _states(model).get(endpoint) if endpoint else None
+        if state is None:
+            return
+        state.outstanding = max(state.outstanding - 1, 0)
+        if counts:
+            state.observe(max(elapsed or 0.0, ENDPOINT_FAILURE_LATENCY))
+            _mark_failure(model, state, str(error)[:200])
+
+
+def record_cancelled(model: str, endpoint: Optional[str], elapsed: float):
+    """
+    Finish a request cancelled before it answered, e.g. the losing side of a hedge. It took
+    at least elapsed seconds, so that is folded in as a lower bound on the replica's latency.
+    """
+    with _lock:
+        state = _states(model).get(endpoint) if endpoint else None
+        if state is None:
+            return
+        state.outstanding = max(state.outstanding - 1, 0)
+        state.observe(max(elapsed, state.latency or 0.0))
+
+
+def is_endpoint_failure(error: BaseException) -> bool:
+    """Whether an error points at the replica (connection, timeout, 5xx, 429) rather than the request"""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status >= 500 or status == 429
+    return isinstance(error, (httpx.HTTPError, OSError, asyncio.TimeoutError))
+
+
+def _health_url(endpoint: str) -> str:
+    base = endpoint.rstrip("/")
+    if base.endswith("/v1"):
+        base = base[:-3]
+    return base + ENDPOINT_HEALTH_PATH
+
+
+async def _check(http: httpx.AsyncClient, model: str, endpoint: str):
+    error = None
+    try:
+        response = await http.get(_health_url(endpoint))
+        if response.status_code != 200:
+            error = f"health check returned {response.status_code}"
+    except Exception as e:
+        error = f"health check failed: {e}"
+
+    with _lock:
+        state = _states(model).get(endpoint)
+        if state is None:
+            return
+        _stats["health_checks"] += 1
+        state.last_health_check = time.monotonic()
+        state.healthy = error is None
+        if error is None:
+            # Let the next request through as a trial instead of waiting out the cooldown
+            if state.state == OPEN:
+                state.state = HALF_OPEN
+        else:
+            _stats["health_check_failures"] += 1
+            _mark_failure(model, state, error)
+
+
+async def check_endpoints():
+    """Health check every replica of every external model once"""
+    headers = {"Authorization": f"Bearer {HF_TOKEN}"} if HF_TOKEN else None
+    async with httpx.AsyncClient(timeout=ENDPOINT_HEALTH_TIMEOUT, headers=headers, follow_redirects=True) as http:
+        await asyncio.gather(*[
+            _check(http, model, endpoint)
+            for model in list(MODEL_ROUTING)
+            for endpoint in get_model_endpoints(model)
+        ])
+
+
+async def _health_loop():
+    while True:
+        try:
+            await check_endpoints()
+        except Exception as e:
+            print(f"[EndpointBalancer] Health check error: {e}")
+        await asyncio.sleep(ENDPOINT_HEALTH_INTERVAL)
+
+
+def start_endpoint_health_checks():
+    """Start the background health checks on the running loop (no-op if ENDPOINT_HEALTH_INTERVAL is 0)"""
+    global _health_task
+    if ENDPOINT_HEALTH_INTERVAL <= 0 or _health_task is not None:
+        return
+    _health_task = asyncio.get_running_loop().create_task(_health_loop())
+
+
+async def stop_endpoint_health_checks():
+    global _health_task
+    task, _health_task = _health_task, None
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+def _forget_model(model: str):
+    # Rebuilt from MODEL_ROUTING on next use; states of unchanged endpoints are kept
+    with _lock:
+        if model not in MODEL_ROUTING:
+            _endpoints.pop(model, None)
+        else:
+            _states(model)
+
+
+register_config_listener(_forget_model)
+
+
+def get_endpoint_health(model: str) -> List[Dict[str, Any]]:
+    """Per-replica state of model, empty for models without external endpoints"""
+    with _lock:
+        return [state.snapshot() for state in _states(model).values()]
+
+
+def get_endpoint_balancer_stats() -> Dict[str, Any]:
+    """Balancer state for debugging"""
+    with _lock:
+        return {
+            "endpoints": {
+                model: [state.snapshot() for state in states.values()]
+                for model, states in _endpoints.items()
+            },
+            "failure_threshold": CIRCUIT_FAILURE_THRESHOLD,
+            "cooldown_seconds": CIRCUIT_COOLDOWN,
+            "health_interval_seconds": ENDPOINT_HEALTH_INTERVAL,
+            **_stats,
+        }
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Write-through cache of sandbox file contents we wrote or read ourselves,
+# bounded by total bytes across all sandboxes (least recently used evicted first)
+FILE_CACHE_MAX_BYTES = int(os.getenv("FILE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+FILE_CACHE_MAX_FILE_BYTES = int(os.getenv("FILE_CACHE_MAX_FILE_BYTES", str(1024 * 1024)))
+
+
+class CachedFile:
+    """Last known content of one sandbox file"""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.size = len(content.encode("utf-8"))
+        self.sha256 = content_hash(content)
+
+
+# (service_id, path) -> cached file, least recently used first
+_cache: "OrderedDict[tuple[str, str], CachedFile]" = OrderedDict()
+# service_id -> paths cached for that sandbox
+_paths: Dict[str, set] = {}
+_size = 0
+_lock = threading.Lock()
+
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "writes_elided": 0,
+    "evictions": 0,
+    "invalidations": 0,
+}
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _drop(key: tuple[str, str]):
+    global _size
+    entry = _cache.pop(key, None)
+    if entry is None:
+        return
+    _size -= entry.size
+    paths = _paths.get(key[0])
+    if paths is not None:
+        paths.discard(key[1])
+        if not paths:
+            del _paths[key[0]]
+
+
+def get_cached_file(service_id: str, path: str) -> Optional[str]:
+    """Content of a file as last written or read by us, or None if unknown"""
+    key = (service_id, os.path.normpath(path))
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        _cache.move_to_end(key)
+        _stats["hits"] += 1
+        return entry.content
+
+
+def is_unchanged(service_id: str, path: str, content: str) -> bool:
+    """True when the sandbox is known to already hold exactly this content, so the write can be skipped"""
+    key = (service_id, os.path.normpath(path))
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None or entry.sha256 != content_hash(content):
+            return False
+        _cache.move_to_end(key)
+        _stats["writes_elided"] += 1
+        return True
+
+
+def record_file(service_id: str, path: str, content: str):
+    """Remember the content the sandbox now holds for path, after a successful write or read"""
+    global _size
+    key = (service_id, os.path.normpath(path))
+    entry = CachedFile(content)
+    with _lock:
+        _drop(key)
+        if entry.size > FILE_CACHE_MAX_FILE_BYTES:
+            return
+        _cache[key] = entry
+        _paths.setdefault(service_id, set()).add(key[1])
+        _size += entry.size
+        while _size > FILE_CACHE_MAX_BYTES and _cache:
+            _drop(next(iter(_cache)))
+            _stats["evictions"] += 1
+
+
+def invalidate_file(service_id: str, path: str):
+    """Forget one file, e.g. after a failed or partial write"""
+    with _lock:
+        _drop((service_id, os.path.normpath(path)))
+
+
+def invalidate_files(service_id: str):
+    """Forget every file of a sandbox, e.g. after a shell command that may have changed anything"""
+    with _lock:
+        paths = _paths.get(service_id)
+        if not paths:
+            return
+        for path in list(paths):
+            _drop((service_id, path))
+        _stats["invalidations"] += 1
+
+
+def get_file_cache_stats() -> Dict[str, Any]:
+    """Cache statistics for debugging"""
+    with _lock:
+        return {
+            "files": len(_cache),
+            "sandboxes": len(_paths),
+            "bytes": _size,
+            "max_bytes": FILE_CACHE_MAX_BYTES,
+            **_stats,
+        }
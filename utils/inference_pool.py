@@ -0,0 +1,330 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+from huggingface_hub import AsyncInferenceClient
+
+from model_config import MODEL_ROUTING, get_model_endpoints, register_config_listener
+from utils.endpoint_balancer import choose_endpoint, is_endpoint_failure, record_cancelled, record_failure, record_start, record_success
+from utils.request_hedging import allow_hedge, hedge_delay, record_hedge_won, record_latency
+
+# Connection limits for the HTTP connection pool of each pooled inference client
+INFERENCE_MAX_CONNECTIONS = int(os.getenv("INFERENCE_MAX_CONNECTIONS", "100"))
+INFERENCE_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("INFERENCE_MAX_KEEPALIVE_CONNECTIONS", "20"))
+INFERENCE_KEEPALIVE_EXPIRY = float(os.getenv("INFERENCE_KEEPALIVE_EXPIRY", "120"))
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "600"))
+# AsyncInferenceClient keeps every streamed response on its exit stack until it is
+# closed, so long-lived clients are recycled after this many chats
+INFERENCE_CLIENT_MAX_LEASES = int(os.getenv("INFERENCE_CLIENT_MAX_LEASES", "500"))
+# Replicas tried for one chat_completion call before its error is returned
+INFERENCE_MAX_ATTEMPTS = int(os.getenv("INFERENCE_MAX_ATTEMPTS", "2"))
+
+HF_TOKEN = os.getenv("HF_TOKEN")
+
+
+def _async_client_factory() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        event_hooks={"request": [async_hf_request_event_hook], "response": [async_hf_response_event_hook]},
+        limits=httpx.Limits(
+            max_connections=INFERENCE_MAX_CONNECTIONS,
+            max_keepalive_connections=INFERENCE_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=INFERENCE_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(INFERENCE_TIMEOUT, connect=10.0),
+        follow_redirects=True,
+    )
+
+try:
+    from huggingface_hub import set_async_client_factory
+    from huggingface_hub.utils._http import async_hf_request_event_hook, async_hf_response_event_hook
+    set_async_client_factory(_async_client_factory)
+except ImportError as e:
+    print(f"Warning: Could not configure inference HTTP client limits: {e}")
+
+
+class _PooledClient:
+    def __init__(self, client: AsyncInferenceClient, endpoint: Optional[str]):
+        self.client = client
+        self.endpoint = endpoint
+        self.leases = 0
+        self.total_leases = 0
+        self.retired = False
+
+
+# (model, endpoint) -> pooled client, shared across /chat requests
+_clients: Dict[Tuple[str, Optional[str]], _PooledClient] = {}
+# Clients replaced by a config change that are still leased by an in-flight chat
+_retired: List[_PooledClient] = []
+_lock = threading.Lock()
+
+
+def _build_client(model: str, endpoint: Optional[str]) -> _PooledClient:
+    if endpoint:
+        # External endpoint
+        return _PooledClient(AsyncInferenceClient(model=endpoint, token=HF_TOKEN), endpoint)
+    # Local HF model
+    return _PooledClient(AsyncInferenceClient(model, token=HF_TOKEN), None)
+
+
+async def _close(pooled: _PooledClient):
+    try:
+        await pooled.client.close()
+    except Exception as e:
+        print(f"[InferencePool] Error closing client for {pooled.endpoint}: {e}")
+
+
+def _retire(key: Tuple[str, Optional[str]]) -> Optional[_PooledClient]:
+    """Remove a pooled client; returns it if it can be closed right away"""
+    pooled = _clients.pop(key, None)
+    if pooled is None:
+        return None
+    pooled.retired = True
+    if pooled.leases > 0:
+        _retired.append(pooled)
+        print(f"[InferencePool] Retired client for {key[0]} ({key[1] or 'HF Inference API'}), {pooled.leases} calls still using it")
+        return None
+    return pooled
+
+
+def _close_later(pooled: Optional[_PooledClient]):
+    if pooled is None:
+        return
+    try:
+        asyncio.get_running_loop().create_task(_close(pooled))
+    except RuntimeError:
+        # No running loop - connections are released when the client is collected
+        pass
+
+
+def acquire_inference_client(model: str, endpoint: Optional[str] = None) -> Tuple[AsyncInferenceClient, Optional[str]]:
+    """
+    Lease the pooled client for one endpoint of model (the first one if not given).
+    Returns (client, endpoint_url) where endpoint_url is None for local models.
+    Every call must be paired with release_inference_client.
+    """
+    if endpoint is None and model in MODEL_ROUTING:
+        endpoint = (get_model_endpoints(model) or [None])[0]
+    key = (model, endpoint)
+    to_close = None
+    with _lock:
+        pooled = _clients.get(key)
+        if pooled is not None and pooled.total_leases >= INFERENCE_CLIENT_MAX_LEASES:
+            to_close = _retire(key)
+            pooled = None
+        if pooled is None:
+            pooled = _build_client(model, endpoint)
+            _clients[key] = pooled
+            print(f"[InferencePool] Created client for {model} ({pooled.endpoint or 'HF Inference API'})")
+        pooled.leases += 1
+        pooled.total_leases += 1
+    _close_later(to_close)
+    return pooled.client, pooled.endpoint
+
+
+async def release_inference_client(client: AsyncInferenceClient):
+    """Return a leased client, closing it if it was retired and is no longer used"""
+    to_close = None
+    with _lock:
+        for pooled in list(_clients.values()) + _retired:
+            if pooled.client is client:
+                pooled.leases -= 1
+                if pooled.retired and pooled.leases <= 0:
+                    _retired.remove(pooled)
+                    to_close = pooled
+                break
+    if to_close is not None:
+        await _close(to_close)
+
+
+def invalidate_inference_client(model: str):
+    """Drop the pooled clients for model so the next request rebuilds them from MODEL_ROUTING"""
+    with _lock:
+        to_close = [_retire(key) for key in list(_clients) if key[0] == model]
+    for pooled in to_close:
+        _close_later(pooled)
+    print(f"[InferencePool] Dropped clients for {model}")
+
+
+class _Attempt:
+    """One chat_completion call on one endpoint, read up to its first streamed chunk"""
+
+    def __init__(self, client: AsyncInferenceClient, endpoint: Optional[str]):
+        self.client = client
+        self.endpoint = endpoint
+        self.response: Any = None
+        self.stream: Optional[AsyncIterator[Any]] = None
+        self.first_chunk: Any = None
+        self.exhausted = False
+        self.latency: Optional[float] = None
+
+    async def close_stream(self):
+        if self.stream is not None and hasattr(self.stream, "aclose"):
+            try:
+                await self.stream.aclose()
+            except Exception:
+                pass
+
+
+class BalancedInferenceClient:
+    """
+    Stands in for AsyncInferenceClient in the agent loop. Every chat_completion call goes to
+    the replica picked by the endpoint balancer, and is retried once on another replica if
+    it fails before any output was produced. For models with hedging enabled, a call that
+    has no first chunk after the hedge delay is duplicated to a second replica; whichever
+    answers first is used and the other is cancelled.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+
+    async def _start(self, endpoint: Optional[str], kwargs: Dict[str, Any]) -> _Attempt:
+        client, endpoint = acquire_inference_client(self.model, endpoint)
+        record_start(self.model, endpoint)
+        attempt = _Attempt(client, endpoint)
+        started = time.monotonic()
+        try:
+            response = await client.chat_completion(**kwargs)
+            if kwargs.get("stream"):
+                attempt.stream = response.__aiter__()
+                try:
+                    attempt.first_chunk = await attempt.stream.__anext__()
+                except StopAsyncIteration:
+                    attempt.exhausted = True
+            else:
+                attempt.response = response
+        except Exception as e:
+            record_failure(self.model, endpoint, e, counts=is_endpoint_failure(e), elapsed=time.monotonic() - started)
+            await release_inference_client(client)
+            raise
+        except BaseException:
+            # Cancelled as the losing side of a hedge: it took at least this long, which keeps
+            # the hedge delay from drifting down to the winners' latency and steers routing
+            # away from the slow replica
+            elapsed = time.monotonic() - started
+            record_latency(self.model, elapsed)
+            record_cancelled(self.model, endpoint, elapsed)
+            await attempt.close_stream()
+            await release_inference_client(client)
+            raise
+        attempt.latency = time.monotonic() - started
+        record_latency(self.model, attempt.latency)
+        return attempt
+
+    async def _discard(self, attempt: _Attempt):
+        """Drop an attempt that answered but lost the race"""
+        await attempt.close_stream()
+        record_success(self.model, attempt.endpoint, attempt.latency)
+        await release_inference_client(attempt.client)
+
+    async def chat_completion(self, **kwargs) -> Any:
+        endpoints = len(get_model_endpoints(self.model))
+        attempts = min(INFERENCE_MAX_ATTEMPTS, max(endpoints, 1))
+        delay = hedge_delay(self.model)
+        tried: List[Optional[str]] = []
+        # task -> endpoint of every attempt still running
+        pending: Dict[asyncio.Task, Optional[str]] = {}
+
+        def launch() -> asyncio.Task:
+            endpoint = choose_endpoint(self.model, exclude=tried)
+            tried.append(endpoint)
+            task = asyncio.ensure_future(self._start(endpoint, kwargs))
+            pending[task] = endpoint
+            return task
+
+        first = launch()
+        hedge_considered = False
+        try:
+            while True:
+                can_hedge = delay is not None and not hedge_considered and len(tried) < endpoints
+                done, _ = await asyncio.wait(
+                    list(pending), timeout=delay if can_hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedge_considered = True
+                    if allow_hedge(self.model):
+                        launch()
+                        print(f"[InferencePool] No response from {tried[0]} after {delay:.2f}s, hedging to {tried[-1]}")
+                    continue
+
+                error = None
+                for task in done:
+                    pending.pop(task)
+                    if task.exception() is None:
+                        if hedge_considered and task is not first:
+                            record_hedge_won(self.model)
+                        return await self._finish(task.result(), kwargs)
+                    error = task.exception()
+                if pending:
+                    continue
+                if tried[-1] is None or not is_endpoint_failure(error) or len(tried) >= attempts:
+                    raise error
+                print(f"[InferencePool] {tried[-1]} failed for {self.model} ({error}), retrying on another endpoint")
+                launch()
+        finally:
+            # Cancel the losing side of a hedge, or close it if it answered at the same time
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+                    task.add_done_callback(lambda task: task.cancelled() or task.exception())
+                elif task.exception() is None:
+                    await self._discard(task.result())
+
+    async def _finish(self, attempt: _Attempt, kwargs: Dict[str, Any]) -> Any:
+        if not kwargs.get("stream"):
+            record_success(self.model, attempt.endpoint, attempt.latency)
+            await release_inference_client(attempt.client)
+            return attempt.response
+        return self._track_stream(attempt)
+
+    async def _track_stream(self, attempt: _Attempt) -> AsyncIterator[Any]:
+        """Pass the stream through, recording the endpoint's outcome and releasing the lease at the end"""
+        try:
+            if not attempt.exhausted:
+                yield attempt.first_chunk
+                async for chunk in attempt.stream:
+                    yield chunk
+        except Exception as e:
+            record_failure(self.model, attempt.endpoint, e, counts=is_endpoint_failure(e))
+            raise
+        except BaseException:
+            # Abandoned by the consumer (e.g. client disconnect), says nothing about the endpoint
+            record_failure(self.model, attempt.endpoint, "stream abandoned", counts=False)
+            raise
+        else:
+            record_success(self.model, attempt.endpoint, attempt.latency)
+        finally:
+            await release_inference_client(attempt.client)
+
+
+async def close_inference_clients():
+    """Close every pooled client, used on shutdown"""
+    with _lock:
+        pooled_clients = list(_clients.values()) + _retired
+        _clients.clear()
+        _retired.clear()
+    await asyncio.gather(*[_close(pooled) for pooled in pooled_clients])
+
+
+def get_inference_pool_stats() -> Dict[str, Any]:
+    """Pool status for debugging"""
+    with _lock:
+        return {
+            "clients": [
+                {
+                    "model": model,
+                    "endpoint": pooled.endpoint,
+                    "leases": pooled.leases,
+                    "total_leases": pooled.total_leases,
+                }
+                for (model, _), pooled in _clients.items()
+            ],
+            "retired": len(_retired),
+            "max_connections": INFERENCE_MAX_CONNECTIONS,
+            "max_keepalive_connections": INFERENCE_MAX_KEEPALIVE_CONNECTIONS,
+        }
+
+
+register_config_listener(invalidate_inference_client)
@@ -0,0 +1,197 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict
+
+from model_config import get_model_concurrency, register_config_listener
+
+# Requests allowed to wait for a model slot before new ones are rejected, and how long one may wait
+MODEL_MAX_QUEUE = int(os.getenv("MODEL_MAX_QUEUE", "64"))
+MODEL_QUEUE_TIMEOUT = float(os.getenv("MODEL_QUEUE_TIMEOUT", "120"))
+# How often a waiting agent loop re-checks its queue position
+MODEL_QUEUE_POLL_INTERVAL = float(os.getenv("MODEL_QUEUE_POLL_INTERVAL", "0.5"))
+
+
+class ModelQueueFullError(RuntimeError):
+    """Raised when a model already has MODEL_MAX_QUEUE requests waiting"""
+
+
+class ModelTicket:
+    """A request's place in a model's queue; holds a slot once granted until released"""
+
+    def __init__(self, scheduler: "ModelScheduler", session_key: str):
+        self.scheduler = scheduler
+        self.session_key = session_key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.released = False
+
+    @property
+    def granted(self) -> bool:
+        return self.future.done() and not self.future.cancelled()
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for the slot; True once granted"""
+        if self.granted:
+            return True
+        try:
+            await asyncio.wait_for(asyncio.shield(self.future), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def position(self) -> int:
+        """1-based position in the queue, 0 once granted"""
+        return self.scheduler.position(self)
+
+    def release(self):
+        """Give the slot back, or leave the queue if it was never granted. Safe to call twice."""
+        self.scheduler.release(self)
+
+
+class ModelScheduler:
+    """
+    Concurrency limit and bounded wait queue for one model's endpoint.
+
+    Waiting requests are grouped by session and served round-robin across sessions,
+    so one session issuing many back-to-back calls can't starve the others.
+    Runs on the event loop only.
+    """
+
+    def __init__(self, model: str, limit: int, max_queue: int = MODEL_MAX_QUEUE):
+        self.model = model
+        self.limit = limit
+        self.max_queue = max_queue
+        self.active = 0
+        self.queued = 0
+        # session_key -> waiting tickets, the session served next first
+        self._waiting: "OrderedDict[str, deque]" = OrderedDict()
+        self.stats = {
+            "granted": 0,
+            "queued_total": 0,
+            "rejected": 0,
+            "abandoned": 0,
+            "wait_seconds_total": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    def enqueue(self, session_key: str) -> ModelTicket:
+        """Take a slot right away if one is free, otherwise join the queue. Raises ModelQueueFullError."""
+        ticket = ModelTicket(self, session_key)
+        if self.active < self.limit and not self.queued:
+            self._grant(ticket)
+            return ticket
+        if self.queued >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise ModelQueueFullError(
+                f"{self.model} is at capacity ({self.active} running, {self.queued} queued). Please try again shortly."
+            )
+        self._waiting.setdefault(session_key, deque()).append(ticket)
+        self.queued += 1
+        self.stats["queued_total"] += 1
+        return ticket
+
+    def _grant(self, ticket: ModelTicket):
+        self.active += 1
+        waited = time.monotonic() - ticket.enqueued_at
+        self.stats["granted"] += 1
+        self.stats["wait_seconds_total"] += waited
+        self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+        ticket.future.set_result(True)
+
+    def grant_waiting(self):
+        """Hand free slots to waiting requests, one session at a time"""
+        while self.active < self.limit and self._waiting:
+            session_key, tickets = next(iter(self._waiting.items()))
+            ticket = tickets.popleft()
+            self.queued -= 1
+            if tickets:
+                # Round-robin: this session goes behind the others
+                self._waiting.move_to_end(session_key)
+            else:
+                del self._waiting[session_key]
+            if ticket.future.done():
+                continue
+            self._grant(ticket)
+
+    def release(self, ticket: ModelTicket):
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.granted:
+            self.active -= 1
+        else:
+            tickets = self._waiting.get(ticket.session_key)
+            if tickets is not None and ticket in tickets:
+                tickets.remove(ticket)
+                self.queued -= 1
+                if not tickets:
+                    del self._waiting[ticket.session_key]
+            ticket.future.cancel()
+            self.stats["abandoned"] += 1
+        self.grant_waiting()
+
+    def position(self, ticket: ModelTicket) -> int:
+        if ticket.granted:
+            return 0
+        # Replay the round-robin order to find where this ticket will be served
+        sessions = deque(deque(tickets) for tickets in self._waiting.values())
+        position = 0
+        while sessions:
+            tickets = sessions.popleft()
+            position += 1
+            if tickets.popleft() is ticket:
+                return position
+            if tickets:
+                sessions.append(tickets)
+        return position
+
+    def snapshot(self) -> Dict[str, Any]:
+        granted = self.stats["granted"]
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.queued,
+            "waiting_sessions": len(self._waiting),
+            "max_queue": self.max_queue,
+            "avg_wait_seconds": round(self.stats["wait_seconds_total"] / granted, 3) if granted else 0.0,
+            **self.stats,
+        }
+
+
+# model -> scheduler, created on first use
+_schedulers: Dict[str, ModelScheduler] = {}
+
+
+def get_model_scheduler(model: str) -> ModelScheduler:
+    scheduler = _schedulers.get(model)
+    if scheduler is None:
+        scheduler = ModelScheduler(model, get_model_concurrency(model))
+        _schedulers[model] = scheduler
+    return scheduler
+
+
+def acquire_model_slot(model: str, session_key: str) -> ModelTicket:
+    """Queue a model call for session_key; await ticket.wait() before calling the model and release() after"""
+    return get_model_scheduler(model).enqueue(session_key)
+
+
+def _update_limit(model: str):
+    scheduler = _schedulers.get(model)
+    if scheduler is None:
+        return
+    scheduler.limit = get_model_concurrency(model)
+    # Outside the event loop the new limit takes effect on the next release
+    try:
+        asyncio.get_running_loop().call_soon(scheduler.grant_waiting)
+    except RuntimeError:
+        pass
+
+
+register_config_listener(_update_limit)
+
+
+def get_model_scheduler_stats() -> Dict[str, Any]:
+    """Per-model scheduler state for debugging"""
+    return {model: scheduler.snapshot() for model, scheduler in list(_schedulers.items())}
@@ -0,0 +1,122 @@
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Tool output longer than head + tail chars is truncated in the tool result,
+# the full text is kept here and can be paged through with the read_output tool
+TOOL_OUTPUT_HEAD_CHARS = int(os.getenv("TOOL_OUTPUT_HEAD_CHARS", "2000"))
+TOOL_OUTPUT_TAIL_CHARS = int(os.getenv("TOOL_OUTPUT_TAIL_CHARS", "4000"))
+
+# Spilled output kept per session (the chat's sandbox), oldest outputs evicted first,
+# and how many sessions are kept at all
+OUTPUT_STORE_SESSION_MAX_CHARS = int(os.getenv("OUTPUT_STORE_SESSION_MAX_CHARS", str(4 * 1024 * 1024)))
+OUTPUT_STORE_MAX_SESSIONS = int(os.getenv("OUTPUT_STORE_MAX_SESSIONS", "200"))
+
+# Largest page read_output returns at once
+READ_OUTPUT_MAX_LENGTH = TOOL_OUTPUT_HEAD_CHARS + TOOL_OUTPUT_TAIL_CHARS
+
+# Tools whose string results are bounded: command and log output, where the middle is
+# rarely needed. File contents (read_file) are never truncated, the model edits them.
+BOUNDED_OUTPUT_TOOLS = {"run_command", "run_background_command", "set_up_environment", "start_app"}
+
+
+class SessionOutputs:
+    """Spilled outputs of one session, oldest first"""
+
+    def __init__(self):
+        self.outputs: "OrderedDict[str, str]" = OrderedDict()
+        self.size = 0
+
+
+# session_id -> spilled outputs, least recently used first
+_sessions: "OrderedDict[str, SessionOutputs]" = OrderedDict()
+_lock = threading.Lock()
+
+_stats = {
+    "spilled": 0,
+    "spilled_chars": 0,
+    "chars_withheld": 0,
+    "reads": 0,
+    "evicted_outputs": 0,
+}
+
+
+def spill_output(session_id: str, text: str) -> Optional[str]:
+    """Store a full output for later paging and return its ref, or None if it can never fit"""
+    if len(text) > OUTPUT_STORE_SESSION_MAX_CHARS:
+        text = text[-OUTPUT_STORE_SESSION_MAX_CHARS:]
+    ref = f"out-{uuid.uuid4().hex[:12]}"
+    with _lock:
+        session = _sessions.get(session_id)
+        if session is None:
+            session = SessionOutputs()
+            _sessions[session_id] = session
+            while len(_sessions) > OUTPUT_STORE_MAX_SESSIONS:
+                _, evicted = _sessions.popitem(last=False)
+                _stats["evicted_outputs"] += len(evicted.outputs)
+        else:
+            _sessions.move_to_end(session_id)
+
+        session.outputs[ref] = text
+        session.size += len(text)
+        while session.size > OUTPUT_STORE_SESSION_MAX_CHARS and len(session.outputs) > 1:
+            _, evicted = session.outputs.popitem(last=False)
+            session.size -= len(evicted)
+            _stats["evicted_outputs"] += 1
+
+        _stats["spilled"] += 1
+        _stats["spilled_chars"] += len(text)
+    return ref
+
+
+def bound_output(session_id: str, text: str, head: int = TOOL_OUTPUT_HEAD_CHARS, tail: int = TOOL_OUTPUT_TAIL_CHARS) -> str:
+    """Return text unchanged if it is short, otherwise its head and tail with a ref to the spilled full output"""
+    if len(text) <= head + tail:
+        return text
+    ref = spill_output(session_id, text)
+    omitted = len(text) - head - tail
+    with _lock:
+        _stats["chars_withheld"] += omitted
+    return (
+        f"{text[:head]}\n"
+        f"[... {omitted} of {len(text)} chars omitted. Call read_output with ref=\"{ref}\" "
+        f"and an offset/length to see the full output ...]\n"
+        f"{text[-tail:]}"
+    )
+
+
+def read_spilled_output(session_id: str, ref: str, offset: int = 0, length: int = READ_OUTPUT_MAX_LENGTH) -> str:
+    """One page of a spilled output"""
+    with _lock:
+        session = _sessions.get(session_id)
+        text = session.outputs.get(ref) if session else None
+        _stats["reads"] += 1
+    if text is None:
+        return f"Output {ref} not found. It may have expired; run the command again if you still need it."
+
+    offset = max(int(offset or 0), 0)
+    length = min(max(int(length or READ_OUTPUT_MAX_LENGTH), 1), READ_OUTPUT_MAX_LENGTH)
+    end = min(offset + length, len(text))
+    if offset >= len(text):
+        return f"Offset {offset} is past the end of output {ref} ({len(text)} chars)."
+    more = f" Continue with offset={end}." if end < len(text) else ""
+    return f"[{ref}: chars {offset}-{end} of {len(text)}.{more}]\n{text[offset:end]}"
+
+
+def drop_outputs(session_id: str):
+    """Forget every spilled output of a session"""
+    with _lock:
+        _sessions.pop(session_id, None)
+
+
+def get_output_store_stats() -> Dict[str, Any]:
+    """Store statistics for debugging"""
+    with _lock:
+        return {
+            "sessions": len(_sessions),
+            "outputs": sum(len(session.outputs) for session in _sessions.values()),
+            "chars": sum(session.size for session in _sessions.values()),
+            **_stats,
+        }
@@ -0,0 +1,246 @@
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+# Rough bytes-per-token ratio used to report savings in tokens
+BYTES_PER_TOKEN = 4
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+_lock = threading.Lock()
+_stats = {
+    "applied": 0,
+    "failed": 0,
+    "patch_bytes": 0,
+    "full_file_bytes": 0,
+}
+
+
+class PatchError(Exception):
+    """Raised when one or more hunks or edits don't apply; the message lists every failure"""
+
+    def __init__(self, failures: List[str]):
+        self.failures = failures
+        super().__init__("\n".join(failures))
+
+
+class Hunk:
+    """One hunk of a unified diff"""
+
+    def __init__(self, number: int, header: str, old_start: Optional[int], old_count: Optional[int] = None, new_count: Optional[int] = None):
+        self.number = number
+        self.header = header
+        # 1-based line in the original file, None when the header carries no line numbers
+        self.old_start = old_start
+        # Line counts from the header, None for bare "@@ ... @@" headers
+        self.old_count = old_count
+        self.new_count = new_count
+        self.old_lines: List[str] = []
+        self.new_lines: List[str] = []
+
+    @property
+    def complete(self) -> bool:
+        """Whether the hunk already holds as many lines as its header announced"""
+        if self.old_count is None:
+            return False
+        return len(self.old_lines) >= self.old_count and len(self.new_lines) >= self.new_count
+
+
+def _split_lines(text: str) -> tuple[List[str], bool]:
+    # An empty (or new) file has no lines, not a single empty one
+    if not text:
+        return [], False
+    lines = text.split("\n")
+    ends_with_newline = text.endswith("\n")
+    if ends_with_newline:
+        lines.pop()
+    return lines, ends_with_newline
+
+
+def _join_lines(lines: List[str], ends_with_newline: bool) -> str:
+    text = "\n".join(lines)
+    return text + "\n" if ends_with_newline and lines else text
+
+
+def _is_file_header(current: Hunk, lines: List[str], index: int) -> bool:
+    """
+    Whether a "--- "/"+++ " line inside the diff body is a file header rather than a removed
+    "-- ..." or added "++ ..." line: only once the hunk has all its announced lines, or for
+    bare hunk headers, when it is part of a "--- "/"+++ " pair
+    """
+    if current.old_count is not None:
+        return current.complete
+    line = lines[index]
+    if line.startswith("--- "):
+        return index + 1 < len(lines) and lines[index + 1].startswith("+++ ")
+    return index > 0 and lines[index - 1].startswith("--- ")
+
+
+def parse_unified_diff(diff: str) -> List[Hunk]:
+    """Parse the hunks of a single-file unified diff; file headers are ignored"""
+    hunks: List[Hunk] = []
+    current: Optional[Hunk] = None
+    # Drop the diff's own trailing newline so it doesn't read as a blank context line
+    lines = diff.rstrip("\n").split("\n")
+    for index, line in enumerate(lines):
+        if line.startswith("@@"):
+            match = HUNK_HEADER.match(line)
+            # Models often write bare "@@ ... @@" headers, those hunks are located by content
+            if match:
+                current = Hunk(
+                    len(hunks) + 1, line, int(match.group(1)),
+                    int(match.group(2) or 1), int(match.group(4) or 1),
+                )
+            else:
+                current = Hunk(len(hunks) + 1, line, None)
+            hunks.append(current)
+        elif current is None:
+            continue
+        elif line.startswith(("--- ", "+++ ")) and _is_file_header(current, lines, index):
+            continue
+        elif line.startswith("+"):
+            current.new_lines.append(line[1:])
+        elif line.startswith("-"):
+            current.old_lines.append(line[1:])
+        elif line.startswith(" "):
+            current.old_lines.append(line[1:])
+            current.new_lines.append(line[1:])
+        elif line.startswith("\\"):
+            # "\ No newline at end of file"
+            continue
+        elif line == "":
+            # Blank context lines frequently lose their leading space
+            current.old_lines.append("")
+            current.new_lines.append("")
+        else:
+            raise PatchError([f"Hunk {current.number} ({current.header}): line without +, - or space prefix: {line!r}"])
+
+    if not hunks:
+        raise PatchError(["Diff contains no hunks (expected lines starting with @@)"])
+    return hunks
+
+
+def _matches_at(lines: List[str], block: List[str], position: int, loose: bool) -> bool:
+    if position < 0 or position + len(block) > len(lines):
+        return False
+    for offset, expected in enumerate(block):
+        actual = lines[position + offset]
+        if loose:
+            actual, expected = actual.rstrip(), expected.rstrip()
+        if actual != expected:
+            return False
+    return True
+
+
+def _find_block(lines: List[str], block: List[str], expected: int) -> Optional[int]:
+    """Position of block closest to the expected line, exact matches first, then ignoring trailing whitespace"""
+    for loose in (False, True):
+        for distance in range(len(lines) + 1):
+            for position in (expected - distance, expected + distance):
+                if _matches_at(lines, block, position, loose):
+                    return position
+    return None
+
+
+def _describe_mismatch(lines: List[str], hunk: Hunk, expected: int) -> str:
+    location = f"line {expected + 1}" if hunk.old_start is not None else "anywhere in the file"
+    message = f"Hunk {hunk.number} ({hunk.header}): context/removed lines not found near {location}."
+    if hunk.old_start is None or expected >= len(lines):
+        return message
+    for offset, wanted in enumerate(hunk.old_lines):
+        index = expected + offset
+        actual = lines[index] if index < len(lines) else None
+        if actual != wanted:
+            actual_text = repr(actual) if actual is not None else "end of file"
+            return f"{message} At line {index + 1} expected {wanted!r} but found {actual_text}."
+    return message
+
+
+def apply_unified_diff(original: str, diff: str) -> tuple[str, int]:
+    """Apply a unified diff to original, returning (new_content, hunks_applied). Raises PatchError listing every failing hunk."""
+    hunks = parse_unified_diff(diff)
+    lines, ends_with_newline = _split_lines(original)
+    failures = []
+    # Line shift caused by earlier hunks
+    shift = 0
+    for hunk in hunks:
+        expected = (hunk.old_start - 1 if hunk.old_start else 0) + shift
+        if not hunk.old_lines:
+            # Pure insertion, nothing to match against
+            position = min(max(expected + (1 if hunk.old_start else 0), 0), len(lines))
+        else:
+            position = _find_block(lines, hunk.old_lines, expected)
+        if position is None:
+            failures.append(_describe_mismatch(lines, hunk, expected))
+            continue
+        lines[position:position + len(hunk.old_lines)] = hunk.new_lines
+        shift += len(hunk.new_lines) - len(hunk.old_lines)
+
+    if failures:
+        raise PatchError(failures)
+    if not lines:
+        ends_with_newline = False
+    elif not original:
+        ends_with_newline = True
+    return _join_lines(lines, ends_with_newline), len(hunks)
+
+
+def apply_search_replace(original: str, edits: List[Dict[str, str]]) -> tuple[str, int]:
+    """Apply search/replace edits in order, each search must match exactly once. Raises PatchError listing every failing edit."""
+    content = original
+    failures = []
+    for number, edit in enumerate(edits, start=1):
+        search = edit.get("search", "")
+        replace = edit.get("replace", "")
+        if not search:
+            failures.append(f"Edit {number}: search text is empty")
+            continue
+        count = content.count(search)
+        if count == 1:
+            content = content.replace(search, replace, 1)
+            continue
+        if count > 1:
+            failures.append(f"Edit {number}: search text matches {count} times, include more surrounding lines to make it unique")
+            continue
+
+        first_line = search.strip("\n").split("\n")[0].strip()
+        candidates = [
+            str(index + 1)
+            for index, line in enumerate(content.split("\n"))
+            if first_line and line.strip() == first_line
+        ]
+        if candidates:
+            failures.append(
+                f"Edit {number}: search text not found; its first line {first_line!r} appears at line(s) "
+                f"{', '.join(candidates[:5])} but the following lines differ (check whitespace and exact content)"
+            )
+        else:
+            failures.append(f"Edit {number}: search text not found; no line matches {first_line!r}")
+
+    if failures:
+        raise PatchError(failures)
+    return content, len(edits)
+
+
+def record_patch(patch_bytes: int, full_file_bytes: int):
+    """Record an applied patch against the full file the model would otherwise have sent"""
+    with _lock:
+        _stats["applied"] += 1
+        _stats["patch_bytes"] += patch_bytes
+        _stats["full_file_bytes"] += full_file_bytes
+
+
+def record_patch_failure():
+    with _lock:
+        _stats["failed"] += 1
+
+
+def get_patch_stats() -> Dict[str, Any]:
+    """Patch counters and the model output saved by sending patches instead of whole files"""
+    with _lock:
+        saved = max(_stats["full_file_bytes"] - _stats["patch_bytes"], 0)
+        return {
+            **_stats,
+            "bytes_saved": saved,
+            "estimated_tokens_saved": saved // BYTES_PER_TOKEN,
+        }
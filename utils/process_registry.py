@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from koyeb.sandbox import ProcessInfo
+
+from utils.sandbox_registry import get_sandbox
+
+# How long a fetched process list is trusted before list_processes is called again
+PROCESS_CACHE_TTL = float(os.getenv("PROCESS_CACHE_TTL", "5"))
+
+DEV_SERVER_MARKERS = ("npm run dev", "vite")
+
+# Status of a process we launched whose real status hasn't been listed yet
+PENDING_STATUS = "pending"
+
+
+class SandboxProcesses:
+    """Cached process list of one sandbox"""
+
+    def __init__(self):
+        self.processes: Dict[str, ProcessInfo] = {}
+        self.fetched_at = 0.0
+
+
+# service_id -> cached processes
+_registry: Dict[str, SandboxProcesses] = {}
+_lock = threading.Lock()
+
+_stats = {
+    "hits": 0,
+    "refreshes": 0,
+    "launches_recorded": 0,
+}
+
+
+def list_processes(service_id: str, api_token: Optional[str] = None, max_age: float = PROCESS_CACHE_TTL) -> List[ProcessInfo]:
+    """
+    Processes of a sandbox, served from cache when fetched less than max_age seconds ago.
+    A launch recorded since the last fetch forces a fetch, so its real status is always confirmed.
+    """
+    with _lock:
+        entry = _registry.get(service_id)
+        pending = entry is not None and any(process.status == PENDING_STATUS for process in entry.processes.values())
+        if entry is not None and not pending and time.monotonic() - entry.fetched_at < max_age:
+            _stats["hits"] += 1
+            return list(entry.processes.values())
+
+    sandbox = get_sandbox(service_id, api_token=api_token)
+    processes = sandbox.list_processes()
+
+    with _lock:
+        entry = _registry.setdefault(service_id, SandboxProcesses())
+        entry.processes = {process.id: process for process in processes}
+        entry.fetched_at = time.monotonic()
+        _stats["refreshes"] += 1
+    return processes
+
+
+def get_process(service_id: str, process_id: str, api_token: Optional[str] = None) -> Optional[ProcessInfo]:
+    """Look up one process by id"""
+    for process in list_processes(service_id, api_token):
+        if process.id == process_id:
+            return process
+    return None
+
+
+def find_dev_server(service_id: str, project_dir: Optional[str] = "/tmp/my-project", api_token: Optional[str] = None) -> Optional[ProcessInfo]:
+    """The running Vite/npm dev server, optionally restricted to one project directory"""
+    for process in list_processes(service_id, api_token):
+        command = process.command or ""
+        if process.status != "running":
+            continue
+        if not any(marker in command.lower() for marker in DEV_SERVER_MARKERS):
+            continue
+        if project_dir and "cd " in command and project_dir not in command:
+            continue
+        return process
+    return None
+
+
+def record_launch(service_id: str, process_id: str, command: str):
+    """
+    Track a process we just launched as pending. It may crash right away, so the next
+    lookup lists processes again instead of reporting it as running.
+    """
+    with _lock:
+        entry = _registry.get(service_id)
+        if entry is None:
+            # Nothing cached yet, the next lookup fetches the full list
+            return
+        entry.processes[process_id] = ProcessInfo(id=process_id, command=command, status=PENDING_STATUS)
+        _stats["launches_recorded"] += 1
+
+
+def invalidate_processes(service_id: str):
+    """Forget the cached process list, e.g. after a command that may start or stop processes"""
+    with _lock:
+        _registry.pop(service_id, None)
+
+
+def get_process_registry_stats() -> Dict[str, Any]:
+    """Registry statistics for debugging"""
+    with _lock:
+        return {
+            "sandboxes": len(_registry),
+            "ttl_seconds": PROCESS_CACHE_TTL,
+            **_stats,
+        }
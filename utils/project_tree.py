@@ -0,0 +1,214 @@
+import hashlib
+import os
+import posixpath
+import shlex
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from utils.sandbox_registry import get_sandbox
+
+# Default root and depth of the /file-structure tree
+PROJECT_TREE_ROOT = os.getenv("PROJECT_TREE_ROOT", "/tmp/my-project")
+PROJECT_TREE_MAX_DEPTH = int(os.getenv("PROJECT_TREE_MAX_DEPTH", "8"))
+PROJECT_TREE_MAX_PAGE_SIZE = int(os.getenv("PROJECT_TREE_MAX_PAGE_SIZE", "2000"))
+
+# Directory and file names skipped (and not descended into) unless asked otherwise
+PROJECT_TREE_IGNORE = [
+    pattern.strip()
+    for pattern in os.getenv("PROJECT_TREE_IGNORE", "node_modules,.git,node-compile-cache,.vite,dist,.write-files-*,.template-*").split(",")
+    if pattern.strip()
+]
+
+# Listings are reused until one of our writes or commands invalidates them, or this many seconds pass
+PROJECT_TREE_CACHE_TTL = float(os.getenv("PROJECT_TREE_CACHE_TTL", "60"))
+PROJECT_TREE_CACHE_MAX_SIZE = int(os.getenv("PROJECT_TREE_CACHE_MAX_SIZE", "256"))
+
+
+class TreeListing:
+    """Sorted entries of one find run"""
+
+    def __init__(self, root: str, entries: List[Dict[str, Any]], missing: bool = False):
+        self.root = root
+        self.entries = entries
+        # The root did not exist (yet), e.g. before set_up_environment created the project
+        self.missing = missing
+        self.fetched_at = time.monotonic()
+        digest = hashlib.sha256()
+        for entry in entries:
+            digest.update(f"{entry['path']}\t{entry['type']}\t{entry.get('size')}\t{entry.get('mtime')}\n".encode("utf-8"))
+        self.version = digest.hexdigest()[:16]
+
+
+# (service_id, root, depth, ignore) -> listing, least recently used first
+_cache: "OrderedDict[tuple, TreeListing]" = OrderedDict()
+_lock = threading.Lock()
+# One find per key at a time, concurrent pollers wait for it instead of running their own
+_fetch_locks: Dict[tuple, threading.Lock] = {}
+# Bumped on invalidation so a listing fetched before an invalidation is never cached
+_generations: Dict[str, int] = {}
+
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "invalidations": 0,
+}
+
+
+_MISSING_ROOT = "__project_tree_missing_root__"
+
+
+def _find_command(root: str, depth: int, ignore: List[str]) -> str:
+    prune = ""
+    if ignore:
+        names = " -o ".join(f"-name {shlex.quote(pattern)}" for pattern in ignore)
+        prune = f"\\( {names} \\) -prune -o "
+    # type, size, mtime and path relative to root, tab separated; a missing root prints a marker instead
+    return (
+        f"if [ ! -d {shlex.quote(root)} ]; then echo {_MISSING_ROOT}; exit 0; fi; "
+        f"find {shlex.quote(root)} -mindepth 1 -maxdepth {depth} "
+        f"{prune}-printf '%y\\t%s\\t%T@\\t%P\\n'"
+    )
+
+
+def _parse_find_output(root: str, output: str) -> List[Dict[str, Any]]:
+    entries = []
+    for line in output.splitlines():
+        parts = line.split("\t", 3)
+        if len(parts) != 4 or not parts[3]:
+            continue
+        kind, size, mtime, relative = parts
+        entry: Dict[str, Any] = {
+            "path": posixpath.join(root, relative),
+            "name": posixpath.basename(relative),
+            "type": "directory" if kind == "d" else "symlink" if kind == "l" else "file",
+            "depth": relative.count("/") + 1,
+            "mtime": int(float(mtime)) if mtime else None,
+        }
+        if kind != "d":
+            entry["size"] = int(size) if size.isdigit() else None
+        entries.append(entry)
+    # Sort by path components so every directory is directly followed by its contents
+    entries.sort(key=lambda entry: entry["path"].split("/"))
+    return entries
+
+
+def _fetch(service_id: str, root: str, depth: int, ignore: List[str]) -> TreeListing:
+    sandbox = get_sandbox(service_id)
+    result = sandbox.exec(_find_command(root, depth, ignore), timeout=30)
+    if (result.stdout or "").strip() == _MISSING_ROOT:
+        return TreeListing(root, [], missing=True)
+    if getattr(result, "exit_code", 0) != 0 and not result.stdout:
+        raise RuntimeError(result.stderr or f"Could not list {root}")
+    return TreeListing(root, _parse_find_output(root, result.stdout or ""))
+
+
+def get_tree_listing(service_id: str, root: Optional[str] = None, depth: Optional[int] = None, ignore: Optional[List[str]] = None) -> TreeListing:
+    """Listing of a sandbox directory, served from cache when possible"""
+    root = posixpath.normpath(root or PROJECT_TREE_ROOT)
+    if not root.startswith("/"):
+        raise ValueError("root must be an absolute path")
+    depth = min(max(depth or PROJECT_TREE_MAX_DEPTH, 1), PROJECT_TREE_MAX_DEPTH)
+    ignore = PROJECT_TREE_IGNORE if ignore is None else ignore
+    key = (service_id, root, depth, tuple(ignore))
+
+    with _lock:
+        fetch_lock = _fetch_locks.setdefault(key, threading.Lock())
+
+    with fetch_lock:
+        with _lock:
+            listing = _cache.get(key)
+            if listing is not None and time.monotonic() - listing.fetched_at < PROJECT_TREE_CACHE_TTL:
+                _cache.move_to_end(key)
+                _stats["hits"] += 1
+                return listing
+            _stats["misses"] += 1
+            generation = _generations.get(service_id, 0)
+
+        listing = _fetch(service_id, root, depth, ignore)
+
+        with _lock:
+            # Not cached while the root is missing, so the project shows up as soon as it is created
+            if listing.missing or _generations.get(service_id, 0) != generation:
+                return listing
+            _cache[key] = listing
+            _cache.move_to_end(key)
+            while len(_cache) > PROJECT_TREE_CACHE_MAX_SIZE:
+                evicted, _ = _cache.popitem(last=False)
+                _fetch_locks.pop(evicted, None)
+        return listing
+
+
+def build_tree(root: str, entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Nest sorted entries under their directories; parents missing from the page are added without details"""
+    tree: Dict[str, Any] = {"name": posixpath.basename(root) or root, "path": root, "type": "directory", "children": []}
+    directories = {root: tree}
+
+    def directory_node(path: str) -> Dict[str, Any]:
+        node = directories.get(path)
+        if node is None:
+            node = {"name": posixpath.basename(path), "path": path, "type": "directory", "children": []}
+            directory_node(posixpath.dirname(path))["children"].append(node)
+            directories[path] = node
+        return node
+
+    for entry in entries:
+        node = {key: value for key, value in entry.items() if key != "depth"}
+        if entry["type"] == "directory":
+            existing = directories.get(entry["path"])
+            if existing is not None:
+                existing.update(node)
+                continue
+            node["children"] = []
+            directories[entry["path"]] = node
+        directory_node(posixpath.dirname(entry["path"]))["children"].append(node)
+    return tree
+
+
+def get_project_tree(service_id: str, root: Optional[str] = None, depth: Optional[int] = None, ignore: Optional[List[str]] = None, offset: int = 0, limit: int = 500) -> Dict[str, Any]:
+    """One page of a sandbox directory tree, with an etag that changes whenever the page does"""
+    listing = get_tree_listing(service_id, root, depth, ignore)
+    offset = max(offset, 0)
+    page = listing.entries[offset:offset + limit]
+    next_offset = offset + len(page) if offset + len(page) < len(listing.entries) else None
+    etag = hashlib.sha256(f"{listing.version}:{offset}:{limit}".encode("utf-8")).hexdigest()[:32]
+    return {
+        "root": listing.root,
+        "tree": build_tree(listing.root, page),
+        "total": len(listing.entries),
+        "offset": offset,
+        "limit": limit,
+        "next_offset": next_offset,
+        "missing": listing.missing,
+        "etag": etag,
+    }
+
+
+def invalidate_tree(service_id: str):
+    """Forget every cached listing of a sandbox, e.g. after a write or a shell command"""
+    with _lock:
+        _generations[service_id] = _generations.get(service_id, 0) + 1
+        keys = [key for key in _cache if key[0] == service_id]
+        for key in keys:
+            del _cache[key]
+            _fetch_locks.pop(key, None)
+        if keys:
+            _stats["invalidations"] += 1
+
+
+def forget_sandbox_trees(service_id: str):
+    """Drop all state of a deleted sandbox"""
+    invalidate_tree(service_id)
+    with _lock:
+        _generations.pop(service_id, None)
+
+
+def get_project_tree_stats() -> Dict[str, Any]:
+    """Cache statistics for debugging"""
+    with _lock:
+        return {
+            "listings": len(_cache),
+            "ttl_seconds": PROJECT_TREE_CACHE_TTL,
+            **_stats,
+        }
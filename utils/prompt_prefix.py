@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List
+
+from utils.context_compaction import CONTEXT_CHARS_PER_TOKEN, estimate_tokens
+
+# Verification mode: hash the static prompt prefix of every model request and report
+# how much of each request repeats the previous request of the same conversation
+PROMPT_PREFIX_CHECK = os.getenv("PROMPT_PREFIX_CHECK", "false").lower() == "true"
+
+# Leading messages that are identical for every session (the static system prompt)
+PROMPT_STATIC_MESSAGES = 1
+
+_MAX_TRACKED_CONVERSATIONS = 500
+_MAX_TRACKED_PREFIXES = 50
+
+# conversation key -> message hashes of its previous request
+_previous: "OrderedDict[str, List[str]]" = OrderedDict()
+# static prefix hash -> requests that used it
+_prefixes: "OrderedDict[str, int]" = OrderedDict()
+_lock = threading.Lock()
+
+_stats = {
+    "requests": 0,
+    "total_tokens": 0,
+    "cacheable_tokens": 0,
+}
+
+
+def _message_hash(message: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(message, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def static_prefix_hash(messages: List[Dict[str, Any]], tools: List[Dict[str, Any]]) -> str:
+    """Hash of the part of the prompt that should be byte-identical across all sessions"""
+    digest = hashlib.sha256()
+    for message in messages[:PROMPT_STATIC_MESSAGES]:
+        digest.update(json.dumps(message).encode("utf-8"))
+    # Chat templates render the tools schema into the first system block
+    digest.update(json.dumps(tools or []).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def check_prompt_prefix(conversation_key: str, messages: List[Dict[str, Any]], tools: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Report the static prefix hash of a request and how many leading messages (and roughly
+    tokens) it shares with the previous request of the same conversation. Those shared
+    messages are what the endpoint's prefix cache can skip recomputing.
+    """
+    prefix_hash = static_prefix_hash(messages, tools)
+    hashes = [_message_hash(message) for message in messages]
+    tools_tokens = int(len(json.dumps(tools or [])) / CONTEXT_CHARS_PER_TOKEN)
+    message_tokens = [estimate_tokens(message) for message in messages]
+    static_tokens = tools_tokens + sum(message_tokens[:PROMPT_STATIC_MESSAGES])
+
+    with _lock:
+        previous = _previous.get(conversation_key)
+        shared = 0
+        if previous is not None:
+            for old, new in zip(previous, hashes):
+                if old != new:
+                    break
+                shared += 1
+        _previous[conversation_key] = hashes
+        _previous.move_to_end(conversation_key)
+        while len(_previous) > _MAX_TRACKED_CONVERSATIONS:
+            _previous.popitem(last=False)
+
+        first_use = prefix_hash not in _prefixes
+        _prefixes[prefix_hash] = _prefixes.get(prefix_hash, 0) + 1
+        _prefixes.move_to_end(prefix_hash)
+        while len(_prefixes) > _MAX_TRACKED_PREFIXES:
+            _prefixes.popitem(last=False)
+
+        # The static prefix is cacheable across sessions once any request has used it,
+        # beyond that only the messages repeated from this conversation's previous request
+        if first_use and not shared:
+            cacheable_tokens = 0
+        else:
+            reused = max(shared, PROMPT_STATIC_MESSAGES)
+            cacheable_tokens = tools_tokens + sum(message_tokens[:reused])
+        total_tokens = tools_tokens + sum(message_tokens)
+        _stats["requests"] += 1
+        _stats["total_tokens"] += total_tokens
+        _stats["cacheable_tokens"] += cacheable_tokens
+
+    return {
+        "prefix_hash": prefix_hash,
+        "static_prefix_tokens": static_tokens,
+        "shared_messages": shared,
+        "messages": len(messages),
+        "cacheable_tokens": cacheable_tokens,
+        "total_tokens": total_tokens,
+    }
+
+
+def get_prompt_prefix_stats() -> Dict[str, Any]:
+    """Prefix hashes seen and the share of prompt tokens that were cacheable"""
+    with _lock:
+        total = _stats["total_tokens"]
+        return {
+            "enabled": PROMPT_PREFIX_CHECK,
+            "prefixes": dict(_prefixes),
+            "cacheable_ratio": round(_stats["cacheable_tokens"] / total, 3) if total else None,
+            **_stats,
+        }
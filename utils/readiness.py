@@ -0,0 +1,57 @@
+import os
+import time
+from typing import Callable, Optional, Tuple
+
+import httpx
+
+# How long to wait for a dev server to answer, and the probe backoff bounds
+SERVER_READY_TIMEOUT = float(os.getenv("SERVER_READY_TIMEOUT", "60"))
+SERVER_READY_INITIAL_DELAY = float(os.getenv("SERVER_READY_INITIAL_DELAY", "0.25"))
+SERVER_READY_MAX_DELAY = float(os.getenv("SERVER_READY_MAX_DELAY", "2"))
+
+
+def to_url(domain_or_url: str) -> str:
+    """Sandbox domains come back without a scheme"""
+    if domain_or_url.startswith(("http://", "https://")):
+        return domain_or_url
+    return f"https://{domain_or_url}"
+
+
+def wait_for_server_ready(
+    url: str,
+    is_process_alive: Optional[Callable[[], bool]] = None,
+    timeout: float = SERVER_READY_TIMEOUT,
+    initial_delay: float = SERVER_READY_INITIAL_DELAY,
+    max_delay: float = SERVER_READY_MAX_DELAY,
+) -> Tuple[bool, float, str]:
+    """
+    Poll url with exponential backoff until it answers or the deadline passes.
+    is_process_alive is checked between probes so a crashed server fails fast.
+
+    Returns (ready, elapsed_seconds, detail).
+    """
+    start = time.monotonic()
+    delay = initial_delay
+    detail = "no response"
+
+    with httpx.Client(follow_redirects=False) as client:
+        while True:
+            remaining = timeout - (time.monotonic() - start)
+            try:
+                response = client.get(url, timeout=max(min(5.0, remaining), 0.5))
+                # The platform proxy answers 404/5xx until the app is actually serving
+                if response.status_code < 400:
+                    return True, time.monotonic() - start, f"HTTP {response.status_code}"
+                detail = f"HTTP {response.status_code}"
+            except httpx.HTTPError as e:
+                detail = f"{type(e).__name__}: {e}"
+
+            if is_process_alive is not None and not is_process_alive():
+                return False, time.monotonic() - start, f"process is not running ({detail})"
+
+            elapsed = time.monotonic() - start
+            if elapsed + delay > timeout:
+                return False, elapsed, f"timed out after {timeout:.0f}s ({detail})"
+
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from model_config import get_model_endpoints, is_hedging_enabled
+
+# A hedge is sent once the first request is slower than this percentile of recent
+# time-to-first-chunk samples, clamped to [HEDGE_MIN_DELAY, HEDGE_MAX_DELAY]
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_LATENCY_WINDOW = int(os.getenv("HEDGE_LATENCY_WINDOW", "200"))
+# Delay used until HEDGE_MIN_SAMPLES latencies were observed
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "2.0"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "30"))
+# At most this fraction of a model's requests in the last HEDGE_RATE_WINDOW seconds are hedged
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.1"))
+HEDGE_RATE_WINDOW = float(os.getenv("HEDGE_RATE_WINDOW", "60"))
+
+
+class _ModelHedging:
+    def __init__(self):
+        self.latencies: Deque[float] = deque(maxlen=HEDGE_LATENCY_WINDOW)
+        # Monotonic times of recent hedge-eligible requests and of the hedges sent for them
+        self.requests: Deque[float] = deque()
+        self.hedges: Deque[float] = deque()
+        self.stats = {
+            "requests": 0,
+            "hedges_fired": 0,
+            "hedges_won": 0,
+            "hedges_capped": 0,
+        }
+
+    def prune(self, now: float):
+        for times in (self.requests, self.hedges):
+            while times and now - times[0] > HEDGE_RATE_WINDOW:
+                times.popleft()
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[int(round(percentile / 100 * (len(ordered) - 1)))]
+
+
+# model -> latency samples and hedge counters
+_models: Dict[str, _ModelHedging] = {}
+_lock = threading.Lock()
+
+
+def _model(model: str) -> _ModelHedging:
+    """Call with _lock held"""
+    state = _models.get(model)
+    if state is None:
+        state = _ModelHedging()
+        _models[model] = state
+    return state
+
+
+def record_latency(model: str, seconds: float):
+    """Add a time-to-first-chunk sample (whole response time for non-streamed calls)"""
+    with _lock:
+        _model(model).latencies.append(seconds)
+
+
+def hedge_delay(model: str) -> Optional[float]:
+    """
+    Seconds to wait for the first response before hedging a request to model, or None if
+    hedging is disabled for it or it has a single endpoint. Counts the request toward the rate cap.
+    """
+    if not is_hedging_enabled(model) or len(get_model_endpoints(model)) < 2:
+        return None
+    with _lock:
+        state = _model(model)
+        state.requests.append(time.monotonic())
+        state.stats["requests"] += 1
+        if len(state.latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return min(max(state.percentile(HEDGE_PERCENTILE), HEDGE_MIN_DELAY), HEDGE_MAX_DELAY)
+
+
+def allow_hedge(model: str) -> bool:
+    """Whether a hedge may be sent now without exceeding HEDGE_MAX_RATE; counts it as fired if so"""
+    now = time.monotonic()
+    with _lock:
+        state = _model(model)
+        state.prune(now)
+        if len(state.hedges) >= HEDGE_MAX_RATE * len(state.requests):
+            state.stats["hedges_capped"] += 1
+            return False
+        state.hedges.append(now)
+        state.stats["hedges_fired"] += 1
+        return True
+
+
+def record_hedge_won(model: str):
+    """The hedge answered before the original request"""
+    with _lock:
+        _model(model).stats["hedges_won"] += 1
+
+
+def get_hedging_stats() -> Dict[str, Any]:
+    """Per-model hedge counters and latency percentiles for debugging"""
+    now = time.monotonic()
+    with _lock:
+        result = {}
+        for model, state in _models.items():
+            state.prune(now)
+            p50 = state.percentile(50)
+            p_hedge = state.percentile(HEDGE_PERCENTILE)
+            result[model] = {
+                "enabled": is_hedging_enabled(model),
+                "samples": len(state.latencies),
+                "p50_seconds": round(p50, 3) if p50 is not None else None,
+                f"p{HEDGE_PERCENTILE:g}_seconds": round(p_hedge, 3) if p_hedge is not None else None,
+                "recent_hedge_rate": round(len(state.hedges) / len(state.requests), 3) if state.requests else 0.0,
+                **state.stats,
+            }
+        return {
+            "models": result,
+            "percentile": HEDGE_PERCENTILE,
+            "max_rate": HEDGE_MAX_RATE,
+        }
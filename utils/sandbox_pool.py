@@ -0,0 +1,191 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+# Warm pool of ready sandboxes so new sessions skip Sandbox.create
+# SANDBOX_POOL_SIZE=0 disables the pool
+SANDBOX_POOL_SIZE = int(os.getenv("SANDBOX_POOL_SIZE", "0"))
+SANDBOX_POOL_MAX_AGE = float(os.getenv("SANDBOX_POOL_MAX_AGE", "3600"))
+SANDBOX_POOL_INSTANCE_TYPE = os.getenv("SANDBOX_POOL_INSTANCE_TYPE", "small")
+SANDBOX_POOL_REFILL_INTERVAL = float(os.getenv("SANDBOX_POOL_REFILL_INTERVAL", "10"))
+
+
+class KoyebSandboxBackend:
+    """Creates and deletes real Koyeb sandboxes"""
+
+    def create(self, instance_type: str) -> Optional[str]:
+        from create_sandbox import create_sandbox_client
+        return create_sandbox_client(name="pooled-sandbox", instance_type=instance_type)
+
+    def delete(self, service_id: str):
+        from delete_sandbox import delete_sandbox
+        delete_sandbox(service_id)
+
+
+class SandboxPool:
+    """
+    Background-replenished pool of ready sandboxes.
+
+    The backend only needs create(instance_type) -> service_id and delete(service_id),
+    so the pool can be exercised against a fake backend.
+    """
+
+    def __init__(self, backend=None, target_size: int = SANDBOX_POOL_SIZE, max_age: float = SANDBOX_POOL_MAX_AGE, instance_type: str = SANDBOX_POOL_INSTANCE_TYPE, refill_interval: float = SANDBOX_POOL_REFILL_INTERVAL):
+        self.backend = backend or KoyebSandboxBackend()
+        self.target_size = target_size
+        self.max_age = max_age
+        self.instance_type = instance_type
+        self.refill_interval = refill_interval
+
+        # (service_id, created_at) pairs, oldest first
+        self._ready: deque = deque()
+        # Expired sandboxes taken out by claim(), deleted off the caller's thread
+        self._to_delete: deque = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {
+            "created": 0,
+            "claimed": 0,
+            "misses": 0,
+            "expired": 0,
+            "create_failures": 0,
+        }
+
+    def claim(self) -> Optional[str]:
+        """
+        Take a ready sandbox from the pool, or None if the pool is empty.
+        Never blocks on the backend, so it is safe to call from the event loop.
+        """
+        if self.target_size <= 0 and not self._ready:
+            return None
+        now = time.time()
+        expired = []
+        service_id = None
+        with self._lock:
+            while self._ready:
+                candidate, created_at = self._ready.popleft()
+                if now - created_at > self.max_age:
+                    expired.append(candidate)
+                    continue
+                service_id = candidate
+                break
+            if service_id:
+                self._stats["claimed"] += 1
+            else:
+                self._stats["misses"] += 1
+            self._stats["expired"] += len(expired)
+            self._to_delete.extend(expired)
+
+        if expired and self._thread is None:
+            # No replenisher to hand them to
+            threading.Thread(target=self._delete_expired, name="sandbox-pool-delete", daemon=True).start()
+        # Refill (and delete expired sandboxes) right away rather than at the next interval
+        self._wake.set()
+        return service_id
+
+    def _delete_expired(self):
+        while True:
+            with self._lock:
+                if not self._to_delete:
+                    return
+                service_id = self._to_delete.popleft()
+            self._delete(service_id)
+
+    def replenish_once(self):
+        """Drop expired sandboxes and create new ones until the pool is at its target size"""
+        now = time.time()
+        expired = []
+        with self._lock:
+            fresh = deque()
+            for service_id, created_at in self._ready:
+                if now - created_at > self.max_age:
+                    expired.append(service_id)
+                else:
+                    fresh.append((service_id, created_at))
+            self._ready = fresh
+            self._stats["expired"] += len(expired)
+            missing = self.target_size - len(self._ready)
+
+        for service_id in expired:
+            self._delete(service_id)
+        self._delete_expired()
+
+        for _ in range(max(missing, 0)):
+            if self._stop.is_set():
+                return
+            try:
+                service_id = self.backend.create(self.instance_type)
+            except Exception as e:
+                service_id = None
+                print(f"[SandboxPool] Failed to create sandbox: {e}")
+            with self._lock:
+                if not service_id:
+                    self._stats["create_failures"] += 1
+                    continue
+                self._ready.append((service_id, time.time()))
+                self._stats["created"] += 1
+            print(f"[SandboxPool] Added sandbox {service_id} to pool")
+
+    def _delete(self, service_id: str):
+        try:
+            self.backend.delete(service_id)
+            print(f"[SandboxPool] Deleted pooled sandbox {service_id}")
+        except Exception as e:
+            print(f"[SandboxPool] Failed to delete sandbox {service_id}: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.replenish_once()
+            except Exception as e:
+                print(f"[SandboxPool] Replenish failed: {e}")
+            self._wake.wait(self.refill_interval)
+            self._wake.clear()
+
+    def start(self):
+        """Start the background replenisher (no-op when the pool is disabled)"""
+        if self.target_size <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sandbox-pool", daemon=True)
+        self._thread.start()
+        print(f"[SandboxPool] Started with target size {self.target_size}")
+
+    def stop(self, delete_ready: bool = True):
+        """Stop the replenisher and optionally delete unclaimed sandboxes"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if delete_ready:
+            with self._lock:
+                ready = [service_id for service_id, _ in self._ready]
+                self._ready.clear()
+            for service_id in ready:
+                self._delete(service_id)
+            self._delete_expired()
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool status for debugging"""
+        now = time.time()
+        with self._lock:
+            return {
+                "enabled": self.target_size > 0,
+                "target_size": self.target_size,
+                "ready": len(self._ready),
+                "max_age_seconds": self.max_age,
+                "instance_type": self.instance_type,
+                "sandboxes": [
+                    {"service_id": service_id, "age_seconds": round(now - created_at, 1)}
+                    for service_id, created_at in self._ready
+                ],
+                **self._stats,
+            }
+
+
+sandbox_pool = SandboxPool()
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, Optional
+
+from koyeb import Sandbox
+
+# Cached sandbox handles keyed by service_id: service_id -> (sandbox, expires_at)
+SANDBOX_CACHE_TTL = float(os.getenv("SANDBOX_CACHE_TTL", "300"))
+SANDBOX_CACHE_MAX_SIZE = int(os.getenv("SANDBOX_CACHE_MAX_SIZE", "256"))
+
+_cache: "OrderedDict[str, tuple[Any, float]]" = OrderedDict()
+_inflight: Dict[str, Future] = {}
+_lock = threading.Lock()
+
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "coalesced": 0,
+    "evictions": 0,
+    "invalidations": 0,
+}
+
+def _store(service_id: str, sandbox: Any):
+    """Insert a handle and evict least recently used entries over the size limit"""
+    _cache[service_id] = (sandbox, time.monotonic() + SANDBOX_CACHE_TTL)
+    _cache.move_to_end(service_id)
+    while len(_cache) > SANDBOX_CACHE_MAX_SIZE:
+        _cache.popitem(last=False)
+        _stats["evictions"] += 1
+
+def get_sandbox(service_id: str, api_token: Optional[str] = None):
+    """
+    Return a reusable sandbox handle for service_id.
+    Concurrent lookups for the same id share a single control plane call.
+    """
+    api_token = api_token or os.getenv("KOYEB_API_TOKEN")
+
+    with _lock:
+        entry = _cache.get(service_id)
+        if entry is not None:
+            sandbox, expires_at = entry
+            if expires_at > time.monotonic():
+                _cache.move_to_end(service_id)
+                _stats["hits"] += 1
+                return sandbox
+            # Expired
+            del _cache[service_id]
+            _stats["evictions"] += 1
+
+        future = _inflight.get(service_id)
+        if future is not None:
+            _stats["coalesced"] += 1
+            owner = False
+        else:
+            future = Future()
+            _inflight[service_id] = future
+            _stats["misses"] += 1
+            owner = True
+
+    if not owner:
+        return future.result()
+
+    try:
+        sandbox = Sandbox.get_from_id(service_id, api_token=api_token)
+    except Exception as e:
+        with _lock:
+            _inflight.pop(service_id, None)
+        future.set_exception(e)
+        raise
+
+    with _lock:
+        _inflight.pop(service_id, None)
+        if sandbox:
+            _store(service_id, sandbox)
+    future.set_result(sandbox)
+    return sandbox
+
+def register_sandbox(sandbox: Any):
+    """Cache a handle we already hold (e.g. right after Sandbox.create)"""
+    with _lock:
+        _store(sandbox.service_id, sandbox)
+
+def invalidate_sandbox(service_id: str):
+    """Drop the cached handle for service_id"""
+    with _lock:
+        if _cache.pop(service_id, None) is not None:
+            _stats["invalidations"] += 1
+
+def get_sandbox_cache_stats() -> Dict[str, Any]:
+    """Cache statistics for debugging"""
+    with _lock:
+        return {
+            "size": len(_cache),
+            "max_size": SANDBOX_CACHE_MAX_SIZE,
+            "ttl_seconds": SANDBOX_CACHE_TTL,
+            "inflight": len(_inflight),
+            **_stats,
+        }
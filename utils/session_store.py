@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from utils.context_compaction import compact_messages
+
+# Agent conversations kept between /chat turns, least recently used evicted first
+SESSION_STORE_MAX_SESSIONS = int(os.getenv("SESSION_STORE_MAX_SESSIONS", "500"))
+SESSION_STORE_TTL = float(os.getenv("SESSION_STORE_TTL", "3600"))
+
+
+class ChatSession:
+    """The tool-augmented conversation of one chat, without system messages"""
+
+    def __init__(self, session_id: str, service_id: Optional[str], messages: List[Dict[str, Any]]):
+        self.session_id = session_id
+        self.service_id = service_id
+        self.messages = messages
+        self.turns = 0
+        self.updated_at = time.monotonic()
+
+
+# session_id -> session, least recently used first
+_sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+_lock = threading.Lock()
+
+_stats = {
+    "resumed": 0,
+    "started": 0,
+    "expired": 0,
+    "evicted": 0,
+}
+
+
+def _complete_turns(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Cut off an assistant tool call message whose results never arrived (interrupted turn)"""
+    for index in range(len(messages) - 1, -1, -1):
+        message = messages[index]
+        if message.get("role") != "assistant" or not message.get("tool_calls"):
+            continue
+        expected = {tool_call["id"] for tool_call in message["tool_calls"]}
+        answered = {
+            later.get("tool_call_id")
+            for later in messages[index + 1:]
+            if later.get("role") == "tool"
+        }
+        if not expected <= answered:
+            return messages[:index]
+        break
+    return messages
+
+
+def get_session(session_id: str) -> Optional[ChatSession]:
+    """A stored session, or None if unknown or expired"""
+    with _lock:
+        session = _sessions.get(session_id)
+        if session is None:
+            return None
+        if time.monotonic() - session.updated_at > SESSION_STORE_TTL:
+            del _sessions[session_id]
+            _stats["expired"] += 1
+            return None
+        _sessions.move_to_end(session_id)
+        _stats["resumed"] += 1
+        return session
+
+
+def save_session(session_id: str, service_id: Optional[str], messages: List[Dict[str, Any]], budget: int = 0, boundary: int = 0) -> ChatSession:
+    """
+    Store a conversation for the next turn, compacted to budget tokens and without system messages.
+    boundary is the compaction boundary of the turn's last request, so the stored history
+    matches what the model last saw.
+    """
+    if budget:
+        messages, _ = compact_messages(messages, budget, boundary=boundary)
+    messages = _complete_turns([message for message in messages if message.get("role") != "system"])
+
+    with _lock:
+        session = _sessions.get(session_id)
+        if session is None:
+            session = ChatSession(session_id, service_id, messages)
+            _sessions[session_id] = session
+            _stats["started"] += 1
+        else:
+            session.service_id = service_id
+            session.messages = messages
+        session.turns += 1
+        session.updated_at = time.monotonic()
+        _sessions.move_to_end(session_id)
+        while len(_sessions) > SESSION_STORE_MAX_SESSIONS:
+            _sessions.popitem(last=False)
+            _stats["evicted"] += 1
+        return session
+
+
+def drop_session(session_id: str):
+    with _lock:
+        _sessions.pop(session_id, None)
+
+
+def drop_sessions_for_service(service_id: str):
+    """Forget every session that worked in a sandbox, e.g. after it was deleted"""
+    with _lock:
+        for session_id in [key for key, session in _sessions.items() if session.service_id == service_id]:
+            del _sessions[session_id]
+
+
+def get_session_store_stats() -> Dict[str, Any]:
+    """Store statistics for debugging"""
+    with _lock:
+        return {
+            "sessions": len(_sessions),
+            "messages": sum(len(session.messages) for session in _sessions.values()),
+            "ttl_seconds": SESSION_STORE_TTL,
+            **_stats,
+        }
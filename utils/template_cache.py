@@ -0,0 +1,231 @@
+import base64
+import hashlib
+import os
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+# Local store for pre-built project template archives, one file per template version
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", "/tmp/sandbox-template-cache")
+TEMPLATE_ENABLED = os.getenv("TEMPLATE_CACHE_ENABLED", "true").lower() == "true"
+# Templates are built in a dedicated sandbox that no user ever touches
+TEMPLATE_BUILDER_INSTANCE_TYPE = os.getenv("TEMPLATE_BUILDER_INSTANCE_TYPE", "small")
+TEMPLATE_BUILD_TIMEOUT = int(os.getenv("TEMPLATE_BUILD_TIMEOUT", "1200"))
+# After a failed build no new builder sandbox is started for this many seconds
+TEMPLATE_BUILD_RETRY_AFTER = float(os.getenv("TEMPLATE_BUILD_RETRY_AFTER", "900"))
+# The archive moves in parts of this many base64 chars, each well within one file API request's timeout
+TEMPLATE_TRANSFER_CHUNK_CHARS = int(os.getenv("TEMPLATE_TRANSFER_CHUNK_CHARS", str(4 * 1024 * 1024)))
+TEMPLATE_TRANSFER_ATTEMPTS = 2
+
+# Paths (relative to /) captured in the template: the project with its node_modules
+# plus the Node.js install so a restored sandbox needs no apt-get
+TEMPLATE_PATHS = [
+    "tmp/my-project",
+    "usr/bin/node",
+    "usr/bin/npm",
+    "usr/bin/npx",
+    "usr/bin/corepack",
+    "usr/lib/node_modules",
+    "usr/include/node",
+]
+
+_capture_lock = threading.Lock()
+# Versions whose builder sandbox is running
+_capturing: set = set()
+# version -> (monotonic time of the last failed build, error)
+_failures: Dict[str, Tuple[float, str]] = {}
+
+
+def template_version(definition: str) -> str:
+    """Version hash of a template definition (the setup command and captured paths)"""
+    digest = hashlib.sha256()
+    digest.update(definition.encode("utf-8"))
+    digest.update("\n".join(TEMPLATE_PATHS).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def _archive_path(version: str) -> str:
+    # Stored base64 encoded, which is the form the sandbox file API transfers
+    return os.path.join(TEMPLATE_CACHE_DIR, f"template-{version}.tar.gz.b64")
+
+
+def has_template(version: str) -> bool:
+    return os.path.exists(_archive_path(version))
+
+
+def restore_template(sandbox, version: str) -> bool:
+    """
+    Restore a cached template into the sandbox with one bulk upload and one extract.
+    Returns False when no archive exists for this version or the restore failed.
+    """
+    if not TEMPLATE_ENABLED or not has_template(version):
+        return False
+
+    with open(_archive_path(version), "r") as f:
+        archive = f.read()
+
+    remote_path = f"/tmp/.template-{version}.tar.gz.b64"
+    try:
+        # Parts left over from an interrupted restore would be reassembled with ours
+        sandbox.exec(f"rm -f {remote_path}.part-*")
+        chunks = range(0, len(archive), TEMPLATE_TRANSFER_CHUNK_CHARS)
+        for index, start in enumerate(chunks):
+            _transfer(
+                lambda: sandbox.filesystem.write_file(
+                    _part_path(remote_path, index), archive[start:start + TEMPLATE_TRANSFER_CHUNK_CHARS]
+                )
+            )
+        # The parts are reassembled in name order and removed whether or not the extract worked
+        result = sandbox.exec(
+            f"cat {remote_path}.part-* | base64 -d | tar -xzf - -C /; status=$?; rm -f {remote_path}.part-*; "
+            f"[ $status -eq 0 ] && node --version",
+            timeout=300
+        )
+    except Exception as e:
+        print(f"[TemplateCache] Restore of template {version} failed: {e}")
+        try:
+            sandbox.exec(f"rm -f {remote_path}.part-*")
+        except Exception:
+            pass
+        return False
+
+    if getattr(result, "exit_code", 0) != 0:
+        print(f"[TemplateCache] Restore of template {version} failed: {result.stderr}")
+        return False
+
+    print(f"[TemplateCache] Restored template {version} ({len(archive)} bytes)")
+    return True
+
+
+def _part_path(remote_path: str, index: int) -> str:
+    # Zero padded to match split's numeric suffixes, so a shell glob lists the parts in order
+    return f"{remote_path}.part-{index:04d}"
+
+
+def _transfer(operation):
+    """Run one file API request, retrying once since a single part is cheap to resend"""
+    for attempt in range(TEMPLATE_TRANSFER_ATTEMPTS):
+        try:
+            return operation()
+        except Exception:
+            if attempt == TEMPLATE_TRANSFER_ATTEMPTS - 1:
+                raise
+
+
+def _download_template(sandbox, version: str, remote_path: str):
+    # One read per part rather than one request for the whole archive
+    result = sandbox.exec(
+        f"split -b {TEMPLATE_TRANSFER_CHUNK_CHARS} -d -a 4 {remote_path} {remote_path}.part- "
+        f"&& rm -f {remote_path} && ls {remote_path}.part-*",
+        timeout=120
+    )
+    if getattr(result, "exit_code", 0) != 0:
+        raise RuntimeError(result.stderr or "could not split the template archive")
+    parts: List[str] = sorted(result.stdout.split())
+    archive = "".join(_transfer(lambda: sandbox.filesystem.read_file(part).content) for part in parts)
+
+    # Validate before storing so a truncated transfer never becomes the template
+    base64.b64decode(archive, validate=True)
+
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{_archive_path(version)}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(archive)
+    os.replace(tmp_path, _archive_path(version))
+    print(f"[TemplateCache] Captured template {version} ({len(archive)} bytes)")
+
+
+def capture_template(sandbox, version: str):
+    """Archive the set up project and Node.js install of a sandbox into the local template cache"""
+    remote_path = f"/tmp/.template-{version}.tar.gz.b64"
+    paths = " ".join(TEMPLATE_PATHS)
+    result = sandbox.exec(
+        f"cd / && for p in {paths}; do [ -e \"$p\" ] && echo \"$p\"; done"
+        f" | tar -czf {remote_path}.tgz -C / -T -"
+        f" && base64 -w0 {remote_path}.tgz > {remote_path} && rm -f {remote_path}.tgz",
+        timeout=600
+    )
+    if getattr(result, "exit_code", 0) != 0:
+        raise RuntimeError(result.stderr)
+    _download_template(sandbox, version, remote_path)
+
+
+def _build_template(version: str, setup_command: str):
+    from create_sandbox import create_sandbox_client
+    from delete_sandbox import delete_sandbox
+    from utils.sandbox_registry import get_sandbox
+
+    service_id = None
+    try:
+        service_id = create_sandbox_client(name="template-builder", instance_type=TEMPLATE_BUILDER_INSTANCE_TYPE)
+        if not service_id:
+            raise RuntimeError("Could not create a builder sandbox")
+        sandbox = get_sandbox(service_id)
+        print(f"[TemplateCache] Building template {version} in sandbox {service_id}")
+        result = sandbox.exec(setup_command, timeout=TEMPLATE_BUILD_TIMEOUT)
+        if getattr(result, "exit_code", 0) != 0 or "Setup complete!" not in (result.stdout or ""):
+            raise RuntimeError(result.stderr or "setup command did not complete")
+        capture_template(sandbox, version)
+        with _capture_lock:
+            _failures.pop(version, None)
+    except Exception as e:
+        print(f"[TemplateCache] Build of template {version} failed, next attempt in {TEMPLATE_BUILD_RETRY_AFTER:.0f}s: {e}")
+        with _capture_lock:
+            _failures[version] = (time.monotonic(), str(e)[:500])
+    finally:
+        if service_id:
+            try:
+                delete_sandbox(service_id)
+            except Exception as e:
+                print(f"[TemplateCache] Could not delete builder sandbox {service_id}: {e}")
+        with _capture_lock:
+            _capturing.discard(version)
+
+
+def ensure_template(version: str, setup_command: str):
+    """
+    Build the template for version in the background if it isn't cached yet, and no build
+    of it failed within the last TEMPLATE_BUILD_RETRY_AFTER seconds.
+    The build runs setup_command in a fresh sandbox created for it and deleted afterwards,
+    so the template never contains anything a user's session did.
+    """
+    if not TEMPLATE_ENABLED or has_template(version):
+        return
+
+    with _capture_lock:
+        if version in _capturing:
+            return
+        failure = _failures.get(version)
+        if failure is not None and time.monotonic() - failure[0] < TEMPLATE_BUILD_RETRY_AFTER:
+            return
+        _capturing.add(version)
+
+    threading.Thread(
+        target=_build_template,
+        args=(version, setup_command),
+        name=f"template-build-{version}",
+        daemon=True
+    ).start()
+
+
+def get_template_cache_stats(version: Optional[str] = None) -> dict:
+    """Template cache status for debugging"""
+    now = time.monotonic()
+    archives = []
+    if os.path.isdir(TEMPLATE_CACHE_DIR):
+        archives = sorted(name for name in os.listdir(TEMPLATE_CACHE_DIR) if name.endswith(".b64"))
+    return {
+        "enabled": TEMPLATE_ENABLED,
+        "version": version,
+        "available": has_template(version) if version else None,
+        "archives": archives,
+        "capturing": sorted(_capturing),
+        "failed_builds": {
+            failed_version: {
+                "error": error,
+                "retry_in_seconds": max(round(TEMPLATE_BUILD_RETRY_AFTER - (now - failed_at), 1), 0.0),
+            }
+            for failed_version, (failed_at, error) in _failures.items()
+        },
+    }
@@ -0,0 +1,103 @@
+import json
+import uuid
+from typing import Any, Dict, List, Optional
+
+
+class AssembledFunction:
+    """Function name and arguments of a tool call built from stream fragments"""
+
+    def __init__(self):
+        self.name: str = ""
+        self.arguments: str = ""
+
+
+class AssembledToolCall:
+    """Mirrors the attributes of a non-streamed tool call (id, function.name, function.arguments)"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.id: Optional[str] = None
+        self.type = "function"
+        self.function = AssembledFunction()
+
+
+def _arguments_complete(arguments: str) -> bool:
+    # Only attempt a parse when the fragment could close the JSON object
+    if not arguments.rstrip().endswith("}"):
+        return False
+    try:
+        json.loads(arguments)
+        return True
+    except ValueError:
+        return False
+
+
+class ToolCallAssembler:
+    """
+    Assemble streamed tool call deltas into complete tool calls.
+
+    add() returns the tool calls whose arguments became complete with this delta,
+    so they can be dispatched while the rest of the completion is still streaming.
+    finish() returns whatever is left once the stream ends.
+    """
+
+    def __init__(self):
+        self._calls: Dict[int, AssembledToolCall] = {}
+        self._ready: set = set()
+
+    def _mark_ready(self, index: int) -> AssembledToolCall:
+        call = self._calls[index]
+        self._ready.add(index)
+        if not call.id:
+            call.id = f"call_{uuid.uuid4().hex[:24]}"
+        if not call.function.arguments:
+            call.function.arguments = "{}"
+        return call
+
+    def add(self, tool_call_deltas: List[Any]) -> List[AssembledToolCall]:
+        completed = []
+        for delta in tool_call_deltas:
+            index = getattr(delta, "index", None)
+            if index is None:
+                index = len(self._calls)
+
+            # A new index means every earlier call has finished streaming
+            if index not in self._calls:
+                for other_index in sorted(self._calls):
+                    if other_index < index and other_index not in self._ready:
+                        completed.append(self._mark_ready(other_index))
+                self._calls[index] = AssembledToolCall(index)
+
+            call = self._calls[index]
+            if getattr(delta, "id", None) and index not in self._ready:
+                call.id = delta.id
+            function = getattr(delta, "function", None)
+            if function is not None:
+                if getattr(function, "name", None):
+                    call.function.name += function.name
+                arguments = getattr(function, "arguments", None)
+                if arguments:
+                    # Some servers send the full arguments as a dict in one delta
+                    if isinstance(arguments, dict):
+                        arguments = json.dumps(arguments)
+                    call.function.arguments += arguments
+
+            if (
+                index not in self._ready
+                and call.function.name
+                and _arguments_complete(call.function.arguments)
+            ):
+                completed.append(self._mark_ready(index))
+        return completed
+
+    def finish(self) -> List[AssembledToolCall]:
+        completed = []
+        for index in sorted(self._calls):
+            if index not in self._ready:
+                completed.append(self._mark_ready(index))
+        return completed
+
+    @property
+    def tool_calls(self) -> List[AssembledToolCall]:
+        """All tool calls in index order"""
+        return [self._calls[index] for index in sorted(self._calls)]
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Bounded worker pool for blocking tool calls (sandbox SDK calls, sleeps, etc.)
+TOOL_EXECUTOR_MAX_WORKERS = int(os.getenv("TOOL_EXECUTOR_MAX_WORKERS", "32"))
+TOOL_EXECUTOR_MAX_QUEUE = int(os.getenv("TOOL_EXECUTOR_MAX_QUEUE", "128"))
+TOOL_DEFAULT_TIMEOUT = float(os.getenv("TOOL_DEFAULT_TIMEOUT", "300"))
+
+# Per-tool timeouts in seconds, anything not listed uses TOOL_DEFAULT_TIMEOUT
+TOOL_TIMEOUTS: Dict[str, float] = {
+    "set_up_environment": 900,
+    "run_command": 330,
+    "create_file_and_add_code": 60,
+    "write_files": 120,
+    "apply_patch": 60,
+    "read_file": 60,
+    "start_app": 180,
+    "expose_endpoint": 60,
+    "read_output": 30,
+}
+
+class ToolQueueFullError(RuntimeError):
+    """Raised when the tool executor has too many pending calls"""
+
+_executor = ThreadPoolExecutor(
+    max_workers=TOOL_EXECUTOR_MAX_WORKERS,
+    thread_name_prefix="tool-worker",
+)
+_lock = threading.Lock()
+
+_stats = {
+    "queued": 0,
+    "running": 0,
+    "submitted": 0,
+    "completed": 0,
+    "failed": 0,
+    "timeouts": 0,
+    "rejected": 0,
+}
+
+def get_tool_timeout(tool_name: str) -> float:
+    """Timeout in seconds for the given tool"""
+    return TOOL_TIMEOUTS.get(tool_name, TOOL_DEFAULT_TIMEOUT)
+
+def _run_tracked(func: Callable, args: tuple, kwargs: dict) -> Any:
+    with _lock:
+        _stats["queued"] -= 1
+        _stats["running"] += 1
+    try:
+        return func(*args, **kwargs)
+    finally:
+        with _lock:
+            _stats["running"] -= 1
+
+async def run_in_tool_executor(tool_name: str, func: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+    """
+    Run a blocking callable on the tool worker pool without blocking the event loop.
+    Raises ToolQueueFullError when the pool backlog is full and asyncio.TimeoutError
+    when the call exceeds its timeout. A timed out call keeps running in its worker
+    thread, but the caller stops waiting for it.
+    """
+    with _lock:
+        if _stats["queued"] >= TOOL_EXECUTOR_MAX_QUEUE:
+            _stats["rejected"] += 1
+            raise ToolQueueFullError(
+                f"Tool executor queue is full ({TOOL_EXECUTOR_MAX_QUEUE} pending calls)"
+            )
+        _stats["queued"] += 1
+        _stats["submitted"] += 1
+
+    if timeout is None:
+        timeout = get_tool_timeout(tool_name)
+
+    start = time.monotonic()
+    future = asyncio.wrap_future(_executor.submit(_run_tracked, func, args, kwargs))
+    try:
+        # Shield so a timeout never cancels a call that is still queued,
+        # which would leave the queue depth counter out of sync
+        result = await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+    except asyncio.TimeoutError:
+        with _lock:
+            _stats["timeouts"] += 1
+        print(f"[ToolExecutor] {tool_name} timed out after {timeout}s")
+        raise
+    except Exception:
+        with _lock:
+            _stats["failed"] += 1
+        raise
+
+    with _lock:
+        _stats["completed"] += 1
+    print(f"[ToolExecutor] {tool_name} finished in {time.monotonic() - start:.2f}s")
+    return result
+
+def get_tool_executor_stats() -> Dict[str, Any]:
+    """Executor queue depth and counters for debugging"""
+    with _lock:
+        return {
+            "max_workers": TOOL_EXECUTOR_MAX_WORKERS,
+            "max_queue": TOOL_EXECUTOR_MAX_QUEUE,
+            **_stats,
+        }
@@ -0,0 +1,47 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from utils.tools import get_tool_effect
+
+
+class ToolCallScheduler:
+    """
+    Schedules the tool calls of one model turn by their declared effects.
+
+    Consecutive "read" calls run concurrently; a "write" call starts only after every
+    call dispatched before it has finished, and calls after a write wait for that write.
+    Results are looked up by tool call index, so callers can still consume them in order.
+    """
+
+    def __init__(self, execute: Callable[[Any], Awaitable[Any]]):
+        self.execute = execute
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self._last_write: Optional[asyncio.Task] = None
+        self._reads_since_write: List[asyncio.Task] = []
+
+    def schedule(self, tool_call) -> asyncio.Task:
+        """Start a tool call as soon as its dependencies allow"""
+        is_read = get_tool_effect(tool_call.function.name) == "read"
+        dependencies = [self._last_write] if self._last_write else []
+        if not is_read:
+            dependencies += self._reads_since_write
+
+        task = asyncio.create_task(self._run_after(dependencies, tool_call))
+        if is_read:
+            self._reads_since_write.append(task)
+        else:
+            self._last_write = task
+            self._reads_since_write = []
+        self.tasks[tool_call.index] = task
+        return task
+
+    async def _run_after(self, dependencies: List[asyncio.Task], tool_call) -> Any:
+        if dependencies:
+            # asyncio.wait doesn't raise if a dependency failed
+            await asyncio.wait(dependencies)
+        return await self.execute(tool_call)
+
+    async def result(self, tool_call) -> Any:
+        """Wait for a scheduled call's result"""
+        return await self.tasks[tool_call.index]
+
@@ -1,6 +1,27 @@
+from utils.output_store import READ_OUTPUT_MAX_LENGTH
+
 # Find the tools array and add the read_file tool definition
 # It should be added after the create_file_and_add_code tool
 
+# Declared side effects of each tool, used to schedule calls from one model turn:
+# "read" calls only observe the sandbox and may run concurrently with each other,
+# "write" calls may change it and run alone, after everything dispatched before them.
+# Tools not listed are treated as "write".
+TOOL_EFFECTS = {
+    "read_file": "read",
+    "read_output": "read",
+    "set_up_environment": "write",
+    "run_command": "write",
+    "create_file_and_add_code": "write",
+    "write_files": "write",
+    "apply_patch": "write",
+    "start_app": "write",
+    "expose_endpoint": "write",
+}
+
+def get_tool_effect(tool_name: str) -> str:
+    return TOOL_EFFECTS.get(tool_name, "write")
+
 tools = [
     {
         "type": "function",
@@ -65,6 +86,84 @@ tools = [
             }
         }
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "write_files",
+            "description": "Create or overwrite several files at once, creating directories as needed. Prefer this over create_file_and_add_code when writing more than one file. Use ONLY for files in /tmp/my-project. Returns each file's path, size and hash, not its content.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "service_id": {
+                        "type": "string",
+                        "description": "The service ID of the sandbox"
+                    },
+                    "files": {
+                        "type": "array",
+                        "description": "The files to write",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "path": {
+                                    "type": "string",
+                                    "description": "Full path to the file (must be in /tmp/my-project)"
+                                },
+                                "content": {
+                                    "type": "string",
+                                    "description": "The complete content to write to the file"
+                                }
+                            },
+                            "required": ["path", "content"]
+                        }
+                    }
+                },
+                "required": ["service_id", "files"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "apply_patch",
+            "description": "Edit part of an existing file without resending all of it. Prefer this over create_file_and_add_code for small changes to existing files. Pass either a unified diff or a list of search/replace edits. Nothing is written unless every hunk or edit applies.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "service_id": {
+                        "type": "string",
+                        "description": "The service ID of the sandbox"
+                    },
+                    "file_path": {
+                        "type": "string",
+                        "description": "Full path to the file (must be in /tmp/my-project)"
+                    },
+                    "diff": {
+                        "type": "string",
+                        "description": "A unified diff for this file with @@ hunk headers and a few lines of unchanged context around each change"
+                    },
+                    "edits": {
+                        "type": "array",
+                        "description": "Search/replace edits applied in order. Each search text must match the file exactly once.",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "search": {
+                                    "type": "string",
+                                    "description": "Exact text to find, including enough surrounding lines to be unique"
+                                },
+                                "replace": {
+                                    "type": "string",
+                                    "description": "Text to put in its place"
+                                }
+                            },
+                            "required": ["search", "replace"]
+                        }
+                    }
+                },
+                "required": ["service_id", "file_path"]
+            }
+        }
+    },
     {
         "type": "function",
         "function": {
@@ -123,5 +222,34 @@ tools = [
                 "required": ["service_id", "port"]
             }
         }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "read_output",
+            "description": "Read part of a long tool output that was truncated. Truncated outputs contain a ref to pass here. Only use this when the omitted part matters.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "service_id": {
+                        "type": "string",
+                        "description": "The service ID of the sandbox"
+                    },
+                    "ref": {
+                        "type": "string",
+                        "description": "The output ref from the truncated tool result"
+                    },
+                    "offset": {
+                        "type": "integer",
+                        "description": "Character offset to start reading from (default 0)"
+                    },
+                    "length": {
+                        "type": "integer",
+                        "description": f"Number of characters to read (default and maximum {READ_OUTPUT_MAX_LENGTH})"
+                    }
+                },
+                "required": ["service_id", "ref"]
+            }
+        }
     }
 ]
\ No newline at end of file
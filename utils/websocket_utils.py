@@ -1,98 +1,294 @@
 import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, List, Optional, Any
 from fastapi import WebSocket
-from queue import Queue
-import threading
 
-# Store active log connections per serviceId
-log_connections: Dict[str, List[WebSocket]] = {}
+# Per-subscriber buffer size and what to do when a subscriber falls behind:
+# "drop_oldest" discards the oldest buffered log, "drop_newest" discards the incoming one
+LOG_SUBSCRIBER_BUFFER_SIZE = int(os.getenv("LOG_SUBSCRIBER_BUFFER_SIZE", "1000"))
+LOG_DROP_POLICY = os.getenv("LOG_DROP_POLICY", "drop_oldest")
 
-# Queue for logs from sync contexts
-log_queue: Queue = Queue()
+# Recent logs kept per service for replay on (re)connect, and how many services to keep
+LOG_REPLAY_BUFFER_SIZE = int(os.getenv("LOG_REPLAY_BUFFER_SIZE", "500"))
+LOG_REPLAY_MAX_SERVICES = int(os.getenv("LOG_REPLAY_MAX_SERVICES", "200"))
 
-async def broadcast_log(service_id: str, log_type: str, message: str, data: Optional[Dict[str, Any]] = None):
-    """Broadcast log messages to all connected log clients for a service"""
-    
-    if service_id not in log_connections:
-        return
-    
+# Slow consumer handling: deadline for a single websocket send, how many seconds a
+# subscriber may stay behind (age of the log it is about to send), and what happens
+# past that: "disconnect" closes the socket, "skip" drops its backlog and sends a log_gap event
+LOG_SEND_TIMEOUT = float(os.getenv("LOG_SEND_TIMEOUT", "5"))
+LOG_MAX_LAG_SECONDS = float(os.getenv("LOG_MAX_LAG_SECONDS", "10"))
+LOG_SLOW_CONSUMER_POLICY = os.getenv("LOG_SLOW_CONSUMER_POLICY", "disconnect")
+
+# Output chunks are coalesced into one log frame per interval or size limit
+LOG_BATCH_INTERVAL = float(os.getenv("LOG_BATCH_INTERVAL", "0.1"))
+LOG_BATCH_MAX_BYTES = int(os.getenv("LOG_BATCH_MAX_BYTES", "16384"))
+
+class SlowConsumerError(Exception):
+    """Raised when a log subscriber can't keep up with its service's logs"""
+
+class LogSubscriber:
+    """A single websocket's bounded view of the logs for one service"""
+
+    def __init__(self, service_id: str, websocket: WebSocket, maxsize: int = LOG_SUBSCRIBER_BUFFER_SIZE, drop_policy: str = LOG_DROP_POLICY):
+        self.service_id = service_id
+        self.websocket = websocket
+        self.drop_policy = drop_policy
+        # Holds (seq, payload, published_at) tuples, payload is the already serialized JSON text
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self.last_sent_seq = 0
+
+    def put(self, seq: int, payload: str):
+        """Buffer a serialized log, applying the drop policy when full. Must run on the event loop."""
+        if self.queue.full():
+            self.dropped += 1
+            if self.drop_policy == "drop_newest":
+                return
+            self.queue.get_nowait()
+        self.queue.put_nowait((seq, payload, time.monotonic()))
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[tuple[int, str, float]]:
+        """Wait for the next (seq, payload, published_at); returns None if timeout expires first"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def lag(self) -> int:
+        """How many events this subscriber is behind the newest log of its service"""
+        if not self.last_sent_seq:
+            return self.queue.qsize()
+        return get_last_log_seq(self.service_id) - self.last_sent_seq
+
+    async def send(self, seq: int, payload: str, published_at: Optional[float] = None):
+        """
+        Send one serialized log with a deadline, enforcing the slow consumer policy.
+        Raises SlowConsumerError when the subscriber should be disconnected.
+        """
+        lag_seconds = time.monotonic() - published_at if published_at else 0
+        if LOG_MAX_LAG_SECONDS and lag_seconds > LOG_MAX_LAG_SECONDS:
+            if LOG_SLOW_CONSUMER_POLICY != "skip":
+                raise SlowConsumerError(f"subscriber is {lag_seconds:.1f}s ({self.lag()} logs) behind")
+            # Drop the backlog and tell the client which range it missed
+            skipped_to = get_last_log_seq(self.service_id)
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.dropped += skipped_to - seq + 1
+            gap = {
+                "type": "log_gap",
+                "message": "⚠️ Connection too slow, skipped logs",
+                "timestamp": datetime.now().isoformat(),
+                "service_id": self.service_id,
+                "data": {"from_seq": seq, "to_seq": skipped_to}
+            }
+            await asyncio.wait_for(self.websocket.send_text(json.dumps(gap)), timeout=LOG_SEND_TIMEOUT)
+            self.last_sent_seq = skipped_to
+            return
+
+        try:
+            await asyncio.wait_for(self.websocket.send_text(payload), timeout=LOG_SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise SlowConsumerError(f"send took longer than {LOG_SEND_TIMEOUT}s")
+        self.last_sent_seq = seq
+
+class ServiceLogBuffer:
+    """Sequence counter and fixed-size ring buffer of recent logs for one service"""
+
+    def __init__(self, maxlen: int = LOG_REPLAY_BUFFER_SIZE):
+        self.last_seq = 0
+        # Holds (seq, payload) pairs
+        self.events: deque = deque(maxlen=maxlen)
+
+    def append(self, log_message: Dict[str, Any]) -> tuple[int, str]:
+        """Assign the next seq and serialize the log once for every subscriber"""
+        self.last_seq += 1
+        log_message["seq"] = self.last_seq
+        event = (self.last_seq, json.dumps(log_message))
+        self.events.append(event)
+        return event
+
+    def since(self, seq: int) -> List[tuple[int, str]]:
+        """Buffered (seq, payload) pairs with a sequence number greater than seq"""
+        if seq >= self.last_seq:
+            # Nothing newer, or the client's seq predates a buffer reset
+            return [] if seq == self.last_seq else list(self.events)
+        return [event for event in self.events if event[0] > seq]
+
+# Replay buffers per serviceId, least recently used first
+log_buffers: "OrderedDict[str, ServiceLogBuffer]" = OrderedDict()
+
+# Active log subscribers per serviceId
+log_subscribers: Dict[str, List[LogSubscriber]] = {}
+
+# Event loop that owns the hub, captured on startup or first subscribe
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _build_log_message(service_id: str, log_type: str, message: str, data: Optional[Dict[str, Any]] = None, timestamp: Optional[str] = None) -> Dict[str, Any]:
     # Use Dict[str, Any] to allow mixed value types
     log_message: Dict[str, Any] = {
         "type": log_type,
         "message": message,
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": timestamp or datetime.now().isoformat(),
         "service_id": service_id
     }
-    
+
     if data is not None:
         log_message["data"] = data
-    
-    # Send to all connected log clients for this service
-    disconnected = []
-    successful_sends = 0
-    
-    for websocket in log_connections[service_id]:
-        try:
-            await websocket.send_json(log_message)
-            successful_sends += 1
-        except Exception as e:
-            print(f"[WebSocket] Failed to send to client: {e}")
-            disconnected.append(websocket)
-        
-    # Remove disconnected websockets
-    for ws in disconnected:
-        if ws in log_connections[service_id]:
-            log_connections[service_id].remove(ws)
-    
-    # Clean up empty connection lists
-    if service_id in log_connections and not log_connections[service_id]:
-        del log_connections[service_id]
+    return log_message
+
+def _get_log_buffer(service_id: str) -> ServiceLogBuffer:
+    buffer = log_buffers.get(service_id)
+    if buffer is None:
+        buffer = ServiceLogBuffer()
+        log_buffers[service_id] = buffer
+        while len(log_buffers) > LOG_REPLAY_MAX_SERVICES:
+            log_buffers.popitem(last=False)
+    else:
+        log_buffers.move_to_end(service_id)
+    return buffer
+
+def _deliver(log_message: Dict[str, Any]):
+    """Sequence and buffer a log message, then hand it to every subscriber. Runs on the event loop."""
+    service_id = log_message["service_id"]
+    seq, payload = _get_log_buffer(service_id).append(log_message)
+    for subscriber in log_subscribers.get(service_id, []):
+        subscriber.put(seq, payload)
+
+async def broadcast_log(service_id: str, log_type: str, message: str, data: Optional[Dict[str, Any]] = None):
+    """Broadcast log messages to all connected log clients for a service"""
+    _deliver(_build_log_message(service_id, log_type, message, data))
 
 def queue_log_for_broadcast(service_id: str, log_type: str, message: str, data: Optional[Dict[str, Any]] = None):
-    """Queue a log message for broadcasting from sync context"""
-    log_item = {
-        "service_id": service_id,
-        "log_type": log_type,
-        "message": message,
-        "data": data,
-        "timestamp": datetime.now().isoformat()
-    }
-    log_queue.put(log_item)
+    """Publish a log message from sync context (any thread), waking subscribers immediately"""
+    if _loop is None:
+        return
 
-async def process_queued_logs():
-    """Process queued logs and broadcast them"""
-    processed_count = 0
-    
-    while not log_queue.empty():
-        try:
-            log_item = log_queue.get_nowait()
-            await broadcast_log(
-                log_item["service_id"],
-                log_item["log_type"], 
-                log_item["message"],
-                log_item["data"]
-            )
-            processed_count += 1
-        except Exception as e:
-            print(f"[WebSocket] Error processing queued log: {e}")
-            break  # Stop processing on error
-
-def add_log_connection(service_id: str, websocket: WebSocket):
-    """Add a websocket connection to the log connections"""
-    if service_id not in log_connections:
-        log_connections[service_id] = []
-    log_connections[service_id].append(websocket)
-
-def remove_log_connection(service_id: str, websocket: WebSocket):
-    """Remove a websocket connection from log connections"""
-    if service_id in log_connections:
-        if websocket in log_connections[service_id]:
-            log_connections[service_id].remove(websocket)
-            print(f"[WebSocket] Removed connection for {service_id}. Remaining: {len(log_connections[service_id])}")
-        if not log_connections[service_id]:
-            del log_connections[service_id]
+    log_message = _build_log_message(service_id, log_type, message, data)
+    try:
+        _loop.call_soon_threadsafe(_deliver, log_message)
+    except RuntimeError:
+        # Loop already closed (shutdown)
+        pass
+
+def start_log_hub():
+    """Bind the log hub to the running event loop so worker threads can publish"""
+    global _loop
+    _loop = asyncio.get_running_loop()
+
+def subscribe_logs(service_id: str, websocket: WebSocket, since: Optional[int] = None) -> tuple[LogSubscriber, List[tuple[int, str]]]:
+    """
+    Register a websocket as a log subscriber for a service. Must run on the event loop.
+    Returns (subscriber, replay) where replay holds the buffered (seq, payload) pairs after `since`;
+    every live log the subscriber receives afterwards has a higher sequence number.
+    """
+    global _loop
+    _loop = asyncio.get_running_loop()
+
+    subscriber = LogSubscriber(service_id, websocket)
+    log_subscribers.setdefault(service_id, []).append(subscriber)
+
+    replay: List[Dict[str, Any]] = []
+    if since is not None and service_id in log_buffers:
+        replay = log_buffers[service_id].since(since)
+    return subscriber, replay
+
+def get_last_log_seq(service_id: str) -> int:
+    """Sequence number of the most recent log for a service, 0 if none"""
+    buffer = log_buffers.get(service_id)
+    return buffer.last_seq if buffer else 0
+
+def unsubscribe_logs(subscriber: LogSubscriber):
+    """Remove a log subscriber"""
+    service_id = subscriber.service_id
+    if service_id in log_subscribers:
+        if subscriber in log_subscribers[service_id]:
+            log_subscribers[service_id].remove(subscriber)
+            print(f"[WebSocket] Removed connection for {service_id}. Remaining: {len(log_subscribers[service_id])}")
+        if not log_subscribers[service_id]:
+            del log_subscribers[service_id]
 
 def get_queue_size():
-    """Get current queue size for debugging"""
-    return log_queue.qsize()
\ No newline at end of file
+    """Get the number of buffered log messages across all subscribers for debugging"""
+    return sum(
+        subscriber.queue.qsize()
+        for subscribers in log_subscribers.values()
+        for subscriber in subscribers
+    )
+
+def get_log_buffer_size():
+    """Get the number of logs held in replay buffers for debugging"""
+    return sum(len(buffer.events) for buffer in log_buffers.values())
+
+def get_log_subscriber_stats() -> Dict[str, Any]:
+    """Subscriber counts and drop counters per service for debugging"""
+    return {
+        service_id: {
+            "connections": len(subscribers),
+            "buffered": sum(subscriber.queue.qsize() for subscriber in subscribers),
+            "dropped": sum(subscriber.dropped for subscriber in subscribers),
+            "max_lag": max(subscriber.lag() for subscriber in subscribers),
+        }
+        for service_id, subscribers in log_subscribers.items()
+    }
+
+class LogBatcher:
+    """
+    Coalesce streamed output chunks into time- or size-bounded log frames.
+
+    publish is called as publish(service_id, log_type, message, data) with the
+    joined chunks; it may be called from a timer thread.
+    """
+
+    def __init__(self, publish: Callable[..., None], service_id: str, log_type: str = "command_output", data: Optional[Dict[str, Any]] = None, interval: float = LOG_BATCH_INTERVAL, max_bytes: int = LOG_BATCH_MAX_BYTES):
+        self.publish = publish
+        self.service_id = service_id
+        self.log_type = log_type
+        self.data = data or {}
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.chunk_count = 0
+        self._chunks: List[str] = []
+        self._size = 0
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+
+    def add(self, chunk: str):
+        """Buffer a chunk, flushing when the batch is full or its interval elapses"""
+        if not chunk:
+            return
+        with self._lock:
+            self._chunks.append(chunk)
+            self._size += len(chunk)
+            self.chunk_count += 1
+            if self._size < self.max_bytes:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.interval, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """Publish everything buffered so far as a single frame"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._chunks:
+                return
+            message = "".join(self._chunks).strip()
+            chunks = len(self._chunks)
+            self._chunks = []
+            self._size = 0
+            # Publish under the lock so a timer flush can't land after close()
+            if message:
+                self.publish(self.service_id, self.log_type, message, {**self.data, "chunks": chunks})
+
+    def close(self):
+        """Flush any remaining output"""
+        self.flush()